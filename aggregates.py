@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+
+from dates import normalize_dates, parse_date
+from models import db, Transaction, SpendingAggregate, bump_data_version, current_ledger_id
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Rows read per pass when rebuilding the aggregates from the transactions table
+REBUILD_CHUNK_SIZE: int = 50000
+
+
+def _bucket_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    # One row per (grain, bucket, category) with summed amounts and row counts
+    import pandas as pd
+    dates = normalize_dates(frame['date'])
+    iso = dates.dt.isocalendar()
+    buckets = {
+        'day': dates.dt.strftime('%Y-%m-%d'),
+        'week': iso['year'].astype(str) + '-W' + iso['week'].astype(str).str.zfill(2),
+        'month': dates.dt.strftime('%Y-%m'),
+        'category': pd.Series('', index=frame.index),
+    }
+    parts = []
+    for grain, bucket in buckets.items():
+        part = frame.groupby([bucket.rename('bucket'), frame['category']])['amount'].agg(['sum', 'count'])
+        part = part.reset_index().rename(columns={'sum': 'total'})
+        part.insert(0, 'grain', grain)
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def _upsert_records(records: List[Dict], sign: int) -> None:
+    # records: ledger_id, grain, bucket, category, total, count; already multiplied by sign
+    statement = insert(SpendingAggregate.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['ledger_id', 'grain', 'bucket', 'category'],
+        set_={'total': SpendingAggregate.total + statement.excluded.total,
+              'count': SpendingAggregate.count + statement.excluded.count})
+    db.session.execute(statement, records)
+    if sign < 0:
+        ledger_aggregates().filter(SpendingAggregate.count <= 0).delete()
+
+
+def _upsert_deltas(frame: pd.DataFrame, sign: int) -> None:
+    if frame.empty:
+        return
+    deltas = _bucket_frame(frame)
+    deltas['total'] *= sign
+    deltas['count'] *= sign
+    deltas.insert(0, 'ledger_id', current_ledger_id())
+    _upsert_records(deltas.to_dict('records'), sign)
+
+
+def ledger_aggregates():
+    return SpendingAggregate.query.filter(SpendingAggregate.ledger_id == current_ledger_id())
+
+
+def apply_transactions(frame: pd.DataFrame, sign: int = 1) -> None:
+    """Add (sign=1) or remove (sign=-1) transactions from the active ledger's running aggregates.
+
+    ``frame`` needs amount, category and date columns. Runs in the caller's
+    session and bumps the data version, unless ``frame`` is empty; the caller commits.
+    """
+    if frame.empty:
+        return
+    _upsert_deltas(frame, sign)
+    bump_data_version()
+
+
+def apply_transaction(transaction, sign: int = 1) -> None:
+    # One row from /add or /delete: the same buckets as _bucket_frame, without pandas
+    buckets = {'category': ''}
+    day = parse_date(transaction.date)
+    if day is not None:
+        year, week, _ = day.isocalendar()
+        buckets.update(day=day.strftime('%Y-%m-%d'), week=f"{year}-W{week:02d}", month=day.strftime('%Y-%m'))
+    ledger_id = current_ledger_id()
+    _upsert_records([{'ledger_id': ledger_id, 'grain': grain, 'bucket': bucket, 'category': int(transaction.category),
+                      'total': sign * float(transaction.amount), 'count': sign}
+                     for grain, bucket in buckets.items()], sign)
+    bump_data_version()
+
+
+def clear_aggregates() -> None:
+    ledger_aggregates().delete()
+    bump_data_version()
+
+
+def rebuild_aggregates() -> None:
+    # Full recompute of the active ledger from the transactions table, in bounded chunks
+    import pandas as pd
+    ledger_aggregates().delete()
+    rows = db.session.query(Transaction.amount, Transaction.category, Transaction.date).filter(
+        Transaction.ledger_id == current_ledger_id())
+    chunk = []
+    for row in rows.yield_per(REBUILD_CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) == REBUILD_CHUNK_SIZE:
+            _upsert_deltas(pd.DataFrame(chunk, columns=['amount', 'category', 'date']), 1)
+            chunk = []
+    _upsert_deltas(pd.DataFrame(chunk, columns=['amount', 'category', 'date']), 1)
+    bump_data_version()
+    db.session.commit()
+
+
+def ensure_aggregates() -> None:
+    # Databases created before the aggregate table existed are backfilled once
+    ledger_id = current_ledger_id()
+    transaction_count = db.session.query(func.count(Transaction.id)).filter(
+        Transaction.ledger_id == ledger_id).scalar()
+    aggregated_count = db.session.query(func.coalesce(func.sum(SpendingAggregate.count), 0)).filter(
+        SpendingAggregate.ledger_id == ledger_id, SpendingAggregate.grain == 'category').scalar()
+    if transaction_count != aggregated_count:
+        rebuild_aggregates()
+
+
+def load_rollups() -> Dict[str, pd.DataFrame]:
+    """Read the week, month and category rollups as small DataFrames for FinanceAdvisor."""
+    import pandas as pd
+    rows = db.session.query(
+        SpendingAggregate.grain, SpendingAggregate.bucket, SpendingAggregate.category,
+        SpendingAggregate.total, SpendingAggregate.count
+    ).filter(SpendingAggregate.ledger_id == current_ledger_id(),
+             SpendingAggregate.grain.in_(['week', 'month', 'category'])).all()
+    frame = pd.DataFrame(rows, columns=['grain', 'bucket', 'category', 'total', 'count'])
+
+    weekly = frame[frame['grain'] == 'week'].copy()
+    weekly['year'] = weekly['bucket'].str[:4].astype(int)
+    weekly['week'] = weekly['bucket'].str[6:].astype(int)
+
+    monthly = frame[frame['grain'] == 'month'].copy()
+    monthly['year'] = monthly['bucket'].str[:4].astype(int)
+    monthly['month'] = monthly['bucket'].str[5:].astype(int)
+
+    by_category = frame[frame['grain'] == 'category'].copy()
+    return {
+        'week': weekly.drop(columns=['grain', 'bucket']),
+        'month': monthly.drop(columns=['grain', 'bucket']),
+        'category': by_category.drop(columns=['grain', 'bucket']),
+    }
@@ -1,184 +1,587 @@
 # backend/app.py
+import importlib
 import os
+import secrets
 import sys
-from flask import Flask, render_template, request, redirect, flash, url_for
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, date
-import pandas as pd
-import io
+import threading
+import click
+from dotenv import load_dotenv
+from flask import (Blueprint, Flask, current_app, render_template, request, redirect, flash, url_for, jsonify, abort,
+                   make_response, g, session, stream_template, stream_with_context)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy import func
+from datetime import date, datetime, timedelta
 import warnings
-import matplotlib.pyplot as plt
-from io import BytesIO
 import base64
-import numpy as np
-from dateutil import parser
+import hashlib
+import time
+from typing import NamedTuple
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from finance_advisor import FinanceAdvisor, CATEGORIES  # Changed import here
-
-app = Flask(__name__,
-          template_folder=os.path.join('..', 'frontend', 'templates'),
-          static_folder=os.path.join('..', 'frontend', 'static'))
-
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.secret_key = 'your_secret_key_here'
-db = SQLAlchemy(app)
-
-class Transaction(db.Model):
-    __tablename__ = 'transactions'
-    id = db.Column(db.Integer, primary_key=True)
-    amount = db.Column(db.Float, nullable=False)
-    category = db.Column(db.Integer, nullable=False)
-    date = db.Column(db.String(10), nullable=False)
-    description = db.Column(db.String(100), default='')
+# Only light modules are imported here. pandas, numpy, matplotlib and scikit-learn are
+# imported by the functions that use them, so worker boot and /add or /delete stay cheap
+from categories import CATEGORIES
+from dates import ISO_DATE_FORMAT
+from ingest import (REQUIRED_COLUMNS, DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE,
+                    validate_frame, iter_batches, read_csv_chunks)
+from models import (DEFAULT_LEDGER_ID, db, Ledger, Transaction, activate_ledger, configure_ledger_databases,
+                    configure_sqlite, current_ledger_id, deactivate_ledger, dispose_ledger_engines,
+                    engine_options, init_db, get_data_version, use_ledger)
+from aggregates import apply_transaction, apply_transactions, clear_aggregates, load_rollups
+from detection import (ANOMALY_THRESHOLD, UploadScreen, clear_category_stats, recent_anomalies,
+                       screen_transaction)
+from charts import CHARTS, CHART_FORMATS, DEFAULT_RENDER_PROCESSES, chart_frame, generate_graphs, render_chart
+from chart_cache import ChartCache, DEFAULT_MAX_BYTES
+from forecasting import (DEFAULT_BACKEND, DEFAULT_FORECAST_PROCESSES, DEFAULT_HORIZONS, FORECAST_GRAINS,
+                         INTERVAL_WIDTH, MAX_HORIZONS, ForecastEngine, rollup_series)
+from jobs import JobQueue
+from model_registry import ModelRegistry
+from profiling import profiler
+from process_pool import shutdown_process_pool
+from snapshot import SnapshotStore
+from queries import NEWEST_FIRST, category_counts, filtered_transactions, filter_args, transaction_page
+from export import EXPORT_FORMATS, PARQUET_INSTALLED, csv_chunks, export_rows, parquet_chunks
+from reports import daily_rollups, month_period, monthly_summary, parse_month, report_charts, report_period
+
+bp = Blueprint('main', __name__, cli_group=None)  # commands such as `flask report` sit at the top level
+job_queue = JobQueue()
+chart_cache = ChartCache()  # shared budget, keys include the ledger
+
+# Imported by preload_modules() in a preforking master, so workers share them after the fork
+HEAVY_MODULES = ('numpy', 'pandas', 'dateutil.parser', 'matplotlib.figure', 'joblib', 'finance_advisor')
+
+
+def _start_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    context._profiling_started = time.perf_counter()
+
+def _stop_sql_timer(conn, cursor, statement, parameters, context, executemany):
+    profiler.record('sql', time.perf_counter() - context._profiling_started)
+
+def create_app(config=None):
+    """Build the app from the environment (a .env file is loaded first), then ``config`` overrides.
+
+    Any setting can also be given as a FLASK_-prefixed environment variable,
+    e.g. FLASK_JOB_WORKERS=2. The database is created or migrated before the
+    app is returned.
+    """
+    load_dotenv()
+    app = Flask(__name__,
+              template_folder=os.path.join('..', 'frontend', 'templates'),
+              static_folder=os.path.join('..', 'frontend', 'static'))
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')  # signs the session cookie; must match across workers
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))  # pooled connections per worker process
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))  # extra connections under bursts
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 30))  # seconds to wait for a free connection
+    app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')  # DELETE restores the old locking
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 30000))  # wait for a concurrent writer
+    app.config['UPLOAD_BATCH_SIZE'] = DEFAULT_BATCH_SIZE  # rows per executemany batch on /upload
+    app.config['UPLOAD_CHUNK_SIZE'] = DEFAULT_CHUNK_SIZE  # rows parsed and committed together on /upload
+    app.config['UPLOAD_MAX_REPORTED_ERRORS'] = 100  # skipped rows listed in the flash message
+    app.config['UPLOAD_DUPLICATES'] = os.environ.get('UPLOAD_DUPLICATES', 'skip')  # 'keep' imports rows already in the ledger, only reporting them
+    app.config['ANOMALY_THRESHOLD'] = ANOMALY_THRESHOLD  # robust z-score from which a transaction is flagged as unusual
+    app.config['RECENT_TRANSACTIONS_LIMIT'] = 10  # rows shown on the dashboard
+    app.config['TRANSACTIONS_PAGE_SIZE'] = 50  # default rows per /all-transactions page
+    app.config['TRANSACTIONS_MAX_PAGE_SIZE'] = 500  # upper bound for ?page_size=
+    app.config['MODEL_DIR'] = os.environ.get('MODEL_DIR', os.path.join(app.instance_path, 'models'))  # persisted FinanceAdvisor models
+    app.config['MODEL_BACKGROUND_TRAINING'] = False  # models are already refitted inside the 'insights' job
+    app.config['SNAPSHOT_DIR'] = os.environ.get('SNAPSHOT_DIR', os.path.join(app.instance_path, 'snapshot'))  # columnar copy for analytics
+    app.config['LEDGER_DATABASE_DIR'] = os.environ.get('LEDGER_DATABASE_DIR')  # one SQLite file per extra ledger, unset = shared database
+    app.config['JOB_WORKERS'] = 1  # threads draining the background job queue
+    app.config['CHART_CACHE_MAX_BYTES'] = DEFAULT_MAX_BYTES  # memory budget for rendered /graphs images
+    app.config['CHART_RENDER_PROCESSES'] = DEFAULT_RENDER_PROCESSES  # processes rendering the 'graphs' job, 1 = inline
+    app.config['FORECAST_BACKEND'] = os.environ.get('FORECAST_BACKEND', DEFAULT_BACKEND)  # 'prophet' or 'smoothing'
+    app.config['FORECAST_PROCESSES'] = DEFAULT_FORECAST_PROCESSES  # processes fitting Prophet models, 1 = inline
+    app.config['PROFILING_ENABLED'] = os.environ.get('PROFILING_ENABLED') == '1'  # timing spans, /metrics, Server-Timing
+    app.config['PROFILING_TRACK_MEMORY'] = os.environ.get('PROFILING_TRACK_MEMORY') == '1'  # RSS delta per span
+    app.config.from_prefixed_env()
+    app.config.update(config or {})
+    if not app.config['SECRET_KEY']:
+        print("Warning: SECRET_KEY is not set; using a random key, so sessions end on restart "
+              "and are not shared between worker processes")
+        app.config['SECRET_KEY'] = secrets.token_hex(32)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(
+        app.config['SQLALCHEMY_DATABASE_URI'], app.config['DB_POOL_SIZE'],
+        app.config['DB_MAX_OVERFLOW'], app.config['DB_POOL_TIMEOUT']))
+
+    configure_sqlite(journal_mode=app.config['SQLITE_JOURNAL_MODE'],
+                     busy_timeout=app.config['SQLITE_BUSY_TIMEOUT_MS'])
+    db.init_app(app)
+    configure_ledger_databases(app.config['LEDGER_DATABASE_DIR'], app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    job_queue.init_app(app)
+    chart_cache.max_bytes = app.config['CHART_CACHE_MAX_BYTES']
+    app.extensions['ledger_services'] = {}
+
+    profiler.enabled = app.config['PROFILING_ENABLED']
+    profiler.track_memory = app.config['PROFILING_TRACK_MEMORY']
+    if profiler.enabled and not event.contains(Engine, 'before_cursor_execute', _start_sql_timer):
+        # On the Engine class, so per-ledger database files are timed too
+        event.listen(Engine, 'before_cursor_execute', _start_sql_timer)
+        event.listen(Engine, 'after_cursor_execute', _stop_sql_timer)
+
+    app.register_blueprint(bp)
+    with app.app_context():
+        init_db()
+        # A preloading server (gunicorn --preload) forks after this, and a forked worker must not share the
+        # master's SQLite connections (main and per-ledger pools) or its render/forecast worker processes
+        db.engine.dispose()
+        dispose_ledger_engines()
+        shutdown_process_pool()
+    return app
+
+
+def preload_modules(app) -> None:
+    """Import the scientific stack now rather than on first use.
+
+    Meant for a preforking server's master process (see gunicorn.conf.py):
+    the workers forked afterwards share these modules and none of them pays
+    the import on its first chart, insight or upload.
+    """
+    started = time.perf_counter()
+    modules = list(HEAVY_MODULES)
+    if app.config['FORECAST_BACKEND'] == 'prophet':
+        modules.append('prophet')
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            print(f"Warning: Could not preload {name} - {e}")
+    app.logger.info("Preloaded %s in %.2fs", ', '.join(modules), time.perf_counter() - started)
+
+
+class LedgerServices(NamedTuple):
+    model_registry: ModelRegistry
+    snapshot_store: SnapshotStore
+    forecast_engine: ForecastEngine
+
+
+_ledger_services_lock = threading.Lock()
+
+def ledger_services() -> LedgerServices:
+    # Models, snapshot and forecasts of the active ledger, each in its own directory
+    ledger_id = current_ledger_id()
+    config = current_app.config
+    with _ledger_services_lock:
+        services = current_app.extensions['ledger_services'].get(ledger_id)
+        if services is None:
+            registry = ModelRegistry(os.path.join(config['MODEL_DIR'], f"ledger-{ledger_id}"),
+                                     background=config['MODEL_BACKGROUND_TRAINING'])
+            services = LedgerServices(
+                registry,
+                SnapshotStore(os.path.join(config['SNAPSHOT_DIR'], f"ledger-{ledger_id}")),
+                ForecastEngine(registry, backend=config['FORECAST_BACKEND'],
+                               processes=config['FORECAST_PROCESSES']))
+            current_app.extensions['ledger_services'][ledger_id] = services
+        return services
+
+@bp.before_app_request
+def start_request_timing():
+    if profiler.enabled:
+        g.profiling_token = profiler.start_request()
+        g.profiling_started = time.perf_counter()
+
+@bp.after_app_request
+def finish_request_timing(response):
+    if profiler.enabled and 'profiling_token' in g:
+        profiler.record(f"route:{request.endpoint}", time.perf_counter() - g.profiling_started)
+        spans = profiler.finish_request(g.pop('profiling_token'))
+        # Opt-in per request, since the header exposes internal timings
+        if request.headers.get('X-Server-Timing') == '1' or request.args.get('server_timing') == '1':
+            response.headers['Server-Timing'] = profiler.server_timing(spans)
+    return response
+
+@bp.before_app_request
+def select_ledger():
+    # X-Ledger-Id header or ?ledger= for one request, otherwise the ledger picked via /ledgers/switch
+    ledger_id = request.headers.get('X-Ledger-Id', type=int) or request.args.get('ledger', type=int)
+    if ledger_id is None:
+        ledger_id = session.get('ledger_id', DEFAULT_LEDGER_ID)
+        if ledger_id != DEFAULT_LEDGER_ID and db.session.get(Ledger, ledger_id) is None:
+            session.pop('ledger_id')
+            ledger_id = DEFAULT_LEDGER_ID
+    elif db.session.get(Ledger, ledger_id) is None:
+        abort(404)
+    g.ledger_token = activate_ledger(ledger_id)
+
+@bp.teardown_app_request
+def release_ledger(exc):
+    if 'ledger_token' in g:
+        deactivate_ledger(g.pop('ledger_token'))
+
+@bp.route('/metrics')
+def metrics():
+    return profiler.prometheus_text(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 warnings.filterwarnings('ignore')
 
-def generate_graphs(transactions):
-    df = pd.DataFrame([{
-        'amount': t.amount,
-        'category': t.category,
-        'date': pd.to_datetime(t.date, errors='coerce'), # Handle potential invalid dates
-        'description': t.description
-    } for t in transactions])
-    df.dropna(subset=['date'], inplace=True) # Remove rows with invalid dates
-
-    graphs = []
-    titles = []
-
-    if df.empty:
-        return graphs, titles
-
-    # Graph 1: Monthly Spending Trend
-    plt.figure(figsize=(12, 6))
-    monthly_spend = df.groupby(pd.Grouper(key='date', freq='M'))['amount'].sum()
-    ax = monthly_spend.plot(kind='line', title='Monthly Spending Trend', color='#3498db')
-    plt.xlabel("Month")
-    plt.ylabel("Total Spending")
-    plt.grid(True)
-    plt.tight_layout()
-    img = BytesIO()
-    plt.savefig(img, format='png', dpi=100)
-    img.seek(0)
-    graphs.append(base64.b64encode(img.getvalue()).decode('utf-8'))
-    titles.append("Monthly Spending Trend")
-    plt.close()
-
-    # Graph 2: Category Distribution
-    plt.figure(figsize=(12, 6))
-    df['category_name'] = df['category'].map(CATEGORIES)
-    df.groupby('category_name')['amount'].sum().plot(
-        kind='pie',
-        autopct='%1.1f%%',
-        startangle=90,
-        wedgeprops={'linewidth': 1, 'edgecolor': 'white'}
-    )
-    plt.title('Spending by Category')
-    plt.ylabel('') # Hide default y-label for pie chart
-    plt.tight_layout()
-    img = BytesIO()
-    plt.savefig(img, format='png', dpi=100)
-    img.seek(0)
-    graphs.append(base64.b64encode(img.getvalue()).decode('utf-8'))
-    titles.append("Spending by Category")
-    plt.close()
-
-    # Graph 3: Weekly Pattern (Bar Chart)
-    plt.figure(figsize=(12, 6))
-    df['day_of_week'] = df['date'].dt.day_name()
-    day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    df['day_of_week'] = pd.Categorical(df['day_of_week'], categories=day_order, ordered=True)
-    df.groupby('day_of_week')['amount'].sum().plot(
-        kind='bar',
-        color='#2ecc71'
-    )
-    plt.title('Weekly Spending Pattern')
-    plt.xlabel("Day of the Week")
-    plt.ylabel("Total Spending")
-    plt.tight_layout()
-    img = BytesIO()
-    plt.savefig(img, format='png', dpi=100)
-    img.seek(0)
-    graphs.append(base64.b64encode(img.getvalue()).decode('utf-8'))
-    titles.append("Weekly Spending Pattern")
-    plt.close()
-
-    # Graph 4: Monthly Trend (Bar Chart)
-    plt.figure(figsize=(12, 6))
-    df['month'] = df['date'].dt.month_name()
-    month_order = ['January', 'February', 'March', 'April', 'May', 'June',
-                   'July', 'August', 'September', 'October', 'November', 'December']
-    df['month'] = pd.Categorical(df['month'], categories=month_order, ordered=True)
-    df.groupby('month')['amount'].sum().plot(
-        kind='bar',
-        color='#9b59b6'
-    )
-    plt.title('Monthly Spending Trend')
-    plt.xlabel("Month")
-    plt.ylabel("Total Spending")
-    plt.tight_layout()
-    img = BytesIO()
-    plt.savefig(img, format='png', dpi=100)
-    img.seek(0)
-    graphs.append(base64.b64encode(img.getvalue()).decode('utf-8'))
-    titles.append("Monthly Spending Trend")
-    plt.close()
-
-    return graphs, titles
-
-@app.route('/')
+def compute_forecasts(rollups=None, horizons=DEFAULT_HORIZONS):
+    # Fitted models are cached by ForecastEngine, so only changed series are refitted
+    if rollups is None:
+        with profiler.span('query:rollups'):
+            rollups = load_rollups()
+    forecast_engine = ledger_services().forecast_engine
+    return {grain: forecast_engine.forecast(rollup_series(rollups, grain), grain, horizon)
+            for grain, horizon in horizons.items()}
+
+def compute_insights():
+    from finance_advisor import FinanceAdvisor
+    with profiler.span('models:current'):
+        models = ledger_services().model_registry.current_models(current_app._get_current_object())
+    with profiler.span('query:rollups'):
+        aggregates = load_rollups()
+    with profiler.span('query:anomalies'):
+        anomalies = recent_anomalies(current_app.config['ANOMALY_THRESHOLD'])
+    advisor = FinanceAdvisor([], aggregates=aggregates,
+                             kmeans_model=models.get('kmeans'),
+                             forecasts=compute_forecasts(aggregates),
+                             anomalies=anomalies,
+                             inference_only=True)
+    return advisor.generate_insights()
+
+def compute_graphs():
+    # Charts read the memory-mapped snapshot rather than materialising ORM rows
+    with profiler.span('snapshot:load'):
+        transactions = ledger_services().snapshot_store.load().frame(description=False)
+    graphs, titles = generate_graphs(transactions, current_app.config['CHART_RENDER_PROCESSES'])
+    return {'graphs': graphs, 'titles': titles}
+
+job_queue.register('insights', compute_insights)
+job_queue.register('graphs', compute_graphs)
+job_queue.register('forecasts', compute_forecasts)
+
+def schedule_refresh():
+    # Precompute insights (including model refits), charts and forecasts after every write
+    for kind in ('insights', 'graphs', 'forecasts'):
+        job_queue.enqueue(kind)
+
+def latest_or_compute(kind, compute):
+    # Serve the newest finished job immediately; only the very first view computes inline
+    latest = job_queue.latest_result(kind)
+    if latest is None:
+        return compute(), False
+    stale = latest.data_version != get_data_version()
+    if stale:
+        job_queue.enqueue(kind)
+    return latest.result, stale
+
+@bp.route('/')
 def home():
-    all_transactions = Transaction.query.order_by(Transaction.date.desc()).all()
-    # Filter out transactions with potentially invalid dates before passing to FinanceAdvisor
-    valid_transactions = [t for t in all_transactions if is_valid_date(t.date)]
-    advisor = FinanceAdvisor(valid_transactions)
-    advice = advisor.generate_insights()
-    recent_transactions = valid_transactions[:10] # Use filtered transactions for recent list
+    ledger_id = current_ledger_id()
+    with profiler.span('query:recent_transactions'):
+        recent_transactions = Transaction.query.filter(Transaction.ledger_id == ledger_id).order_by(
+            *NEWEST_FIRST).limit(current_app.config['RECENT_TRANSACTIONS_LIMIT']).all()
+    with profiler.span('query:transaction_count'):
+        all_transactions_count = db.session.query(func.count(Transaction.id)).filter(
+            Transaction.ledger_id == ledger_id).scalar()
+    with profiler.span('insights:latest'):
+        advice, advice_stale = latest_or_compute('insights', compute_insights)
 
     return render_template('index.html',
                            transactions=recent_transactions,
-                           all_transactions_count=len(valid_transactions),
+                           all_transactions_count=all_transactions_count,
                            advice=advice,
+                           advice_stale=advice_stale,
                            categories=CATEGORIES,
+                           anomaly_threshold=current_app.config['ANOMALY_THRESHOLD'],
+                           ledgers=Ledger.query.order_by(Ledger.id).all(),
+                           ledger_id=ledger_id,
                            today=date.today().isoformat())
 
-@app.route('/all-transactions')
+def current_page():
+    return transaction_page(request.args,
+                            current_app.config['TRANSACTIONS_PAGE_SIZE'],
+                            current_app.config['TRANSACTIONS_MAX_PAGE_SIZE'])
+
+@bp.route('/all-transactions')
 def all_transactions():
-    transactions = Transaction.query.order_by(Transaction.date.desc()).all()
-    # Filter out transactions with potentially invalid dates
-    valid_transactions = [t for t in transactions if is_valid_date(t.date)]
+    transactions, next_cursor, page_size = current_page()
+    filters = filter_args(request.args)
+    next_url = None
+    if next_cursor:
+        next_url = url_for('main.all_transactions', after=next_cursor, page_size=page_size, **filters)
+    with profiler.span('query:category_counts'):
+        counts = category_counts(request.args)
     return render_template('all_transactions.html',
-                           transactions=valid_transactions,
-                           categories=CATEGORIES)
-
-@app.route('/delete-all', methods=['POST'])
+                           transactions=transactions,
+                           categories=CATEGORIES,
+                           category_counts=counts,
+                           anomaly_threshold=current_app.config['ANOMALY_THRESHOLD'],
+                           filters=filters,
+                           export_url=url_for('main.export_transactions', **filters),
+                           # The report is drawn from the daily rollups, so only the date range carries over
+                           report_url=url_for('main.download_report',
+                                              **{key: filters[key] for key in ('start', 'end') if key in filters}),
+                           next_url=next_url,
+                           first_url=url_for('main.all_transactions', page_size=page_size, **filters),
+                           is_first_page='after' not in request.args)
+
+def transaction_json(t):
+    return {
+        'id': t.id,
+        'amount': t.amount,
+        'category': t.category,
+        'category_name': CATEGORIES.get(t.category, 'Unknown'),
+        'date': t.date.isoformat(),
+        'description': t.description or '',
+        'anomaly_score': t.anomaly_score
+    }
+
+@bp.route('/api/transactions')
+def api_transactions():
+    transactions, next_cursor, page_size = current_page()
+    return jsonify({
+        'transactions': [transaction_json(t) for t in transactions],
+        'next_cursor': next_cursor,
+        'page_size': page_size
+    })
+
+@bp.route('/api/search')
+def api_search():
+    # Prefix search over descriptions (?q=sup mark), narrowed by ?category= (repeatable) and ?start=/?end=.
+    # Facet counts per category ignore the category filter; total counts the current selection.
+    with profiler.span('query:search'):
+        transactions, next_cursor, page_size = current_page()
+    with profiler.span('query:category_counts'):
+        counts = category_counts(request.args)
+    selected = set(request.args.getlist('category', type=int))
+    return jsonify({
+        'query': request.args.get('q', '').strip(),
+        'total': sum(count for category, count in counts.items() if not selected or category in selected),
+        'facets': {'category': [{
+            'category': category,
+            'category_name': CATEGORIES.get(category, 'Unknown'),
+            'count': count
+        } for category, count in sorted(counts.items(), key=lambda item: -item[1])]},
+        'transactions': [transaction_json(t) for t in transactions],
+        'next_cursor': next_cursor,
+        'page_size': page_size
+    })
+
+@bp.route('/export')
+def export_transactions():
+    # Streams every filtered transaction (the /all-transactions filters) as ?format=csv or parquet.
+    # Bytes go out as soon as the first chunk is written, and only one chunk is in memory at a time
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        abort(400)
+    if fmt == 'parquet' and not PARQUET_INSTALLED:
+        abort(400, description="Parquet export needs pyarrow: pip install pyarrow")
+    ledger_id = current_ledger_id()
+    # A common search term is matched by walking the date index, which is already in export order
+    query = filtered_transactions(request.args, walk_index=True)
+
+    def generate():
+        with use_ledger(ledger_id):
+            chunks = export_rows(query)
+            yield from (csv_chunks(chunks) if fmt == 'csv' else parquet_chunks(chunks))
+
+    filename = f"transactions-ledger-{ledger_id}-{date.today().isoformat()}.{fmt}"
+    return current_app.response_class(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt],
+                                      headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def report_stream(start, end):
+    # The report as streamed HTML: the summary tables are sent before the charts are rendered
+    days = daily_rollups(start, end)
+    months = monthly_summary(days)
+    category_totals = {}
+    for month in months:
+        for category, total in month['categories'].items():
+            category_totals[category] = category_totals.get(category, 0.0) + total
+    ledger_id = current_ledger_id()
+
+    def advice():
+        # Fetched when the template gets to it, so the tables are already on their way
+        with use_ledger(ledger_id):
+            yield from latest_or_compute('insights', compute_insights)[0]
+
+    if start or end:
+        period = f"{start.isoformat() if start else 'first transaction'} to {end.isoformat() if end else 'today'}"
+    else:
+        period = "All transactions"
+    return stream_template('report.html',
+                           ledger_name=db.session.get(Ledger, ledger_id).name,
+                           period=period,
+                           generated=datetime.now().strftime('%Y-%m-%d %H:%M'),
+                           months=months,
+                           category_ids=sorted(category_totals),
+                           category_totals=category_totals,
+                           categories=CATEGORIES,
+                           advice=advice(),
+                           charts=report_charts(days))
+
+@bp.route('/report')
+def download_report():
+    # One self-contained HTML file for ?month=YYYY-MM or ?start=/?end=: monthly totals per category,
+    # the financial advice and the charts, all read from the rollups rather than the transactions
+    start, end = report_period(request.args)
+    suffix = request.args['month'] if start and request.args.get('month') else date.today().isoformat()
+    filename = f"report-ledger-{current_ledger_id()}-{suffix}.html"
+    return current_app.response_class(report_stream(start, end), mimetype='text/html',
+                                      headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@bp.cli.command('report')
+@click.option('--ledger', 'ledger_id', type=int, default=DEFAULT_LEDGER_ID, show_default=True)
+@click.option('--month', help="YYYY-MM; defaults to the previous calendar month")
+@click.option('--output', type=click.Path(dir_okay=False), help="defaults to report-ledger-<id>-<month>.html")
+def report_command(ledger_id, month, output):
+    """Write the monthly report to a file, e.g. from cron on the first of each month."""
+    if month is None:
+        month = (date.today().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
+    try:
+        start, end = month_period(parse_month(month))
+    except ValueError:
+        raise click.BadParameter("use YYYY-MM", param_hint='--month')
+    output = output or f"report-ledger-{ledger_id}-{month}.html"
+    with use_ledger(ledger_id):
+        if db.session.get(Ledger, ledger_id) is None:
+            raise click.BadParameter(f"no ledger {ledger_id}", param_hint='--ledger')
+        with open(output, 'w', encoding='utf-8') as handle:
+            handle.writelines(report_stream(start, end))
+    click.echo(f"Wrote {output}")
+
+@bp.route('/ledgers', methods=['GET', 'POST'])
+def ledgers():
+    if request.method == 'GET':
+        return jsonify({
+            'current': current_ledger_id(),
+            'ledgers': [{'id': ledger.id, 'name': ledger.name} for ledger in Ledger.query.order_by(Ledger.id)]
+        })
+    name = request.form.get('name', '').strip()[:64]
+    if not name:
+        flash("Enter a ledger name")
+    elif Ledger.query.filter_by(name=name).first():
+        flash(f"A ledger named {name} already exists")
+    else:
+        ledger = Ledger(name=name)
+        db.session.add(ledger)
+        db.session.commit()
+        session['ledger_id'] = ledger.id
+        flash(f"Created ledger {name}")
+    return redirect(url_for('main.home'))
+
+@bp.route('/ledgers/switch', methods=['POST'])
+def switch_ledger():
+    ledger = db.session.get(Ledger, request.form.get('ledger_id', type=int))
+    if ledger is None:
+        flash("Select a valid ledger")
+    else:
+        session['ledger_id'] = ledger.id
+    return redirect(url_for('main.home'))
+
+@bp.route('/delete-all', methods=['POST'])
 def delete_all_transactions():
+    # Only the active ledger is emptied
     try:
-        num_rows_deleted = db.session.query(Transaction).delete()
+        num_rows_deleted = Transaction.query.filter(Transaction.ledger_id == current_ledger_id()).delete()
+        clear_aggregates()
+        clear_category_stats()
         db.session.commit()
+        ledger_services().snapshot_store.clear()
         flash(f"Successfully deleted {num_rows_deleted} transactions!")
+        schedule_refresh()
     except Exception as e:
         db.session.rollback()
         flash("Error deleting transactions")
-    return redirect(url_for('home')) # Redirect to home after deleting all
+    return redirect(url_for('main.home')) # Redirect to home after deleting all
 
-@app.route('/graphs')
+@bp.route('/graphs')
 def show_graphs():
-    transactions = Transaction.query.order_by(Transaction.date.desc()).all()
-    # Filter out transactions with potentially invalid dates for graph generation
-    valid_transactions = [t for t in transactions if is_valid_date(t.date)]
-    graphs, titles = generate_graphs(valid_transactions)
-    return render_template('graphs.html', graphs=graphs, titles=titles)
-
-def is_valid_date(date_string):
-    try:
-        parser.parse(date_string)
-        return True
-    except (ValueError, TypeError):
-        return False
-
-@app.route('/add', methods=['POST'])
+    # The page only links the charts; each image is fetched, cached and revalidated on its own URL
+    filters = filter_args(request.args)
+    fmt = request.args.get('format', 'png')
+    if fmt not in ('png', 'svg'):
+        fmt = 'png'
+    graphs_stale = False
+    if not filters and fmt == 'png':
+        rendered_version = job_queue.latest_version('graphs')
+        graphs_stale = rendered_version is not None and rendered_version != get_data_version()
+        if graphs_stale:
+            job_queue.enqueue('graphs')
+    has_data = filtered_transactions(request.args).limit(1).first() is not None
+    names = list(CHARTS) if has_data else []
+    graphs = [url_for('main.chart_image', name=name, fmt=fmt, **filters) for name in names]
+    titles = [CHARTS[name] for name in names]
+    return render_template('graphs.html', graphs=graphs, titles=titles, graphs_stale=graphs_stale)
+
+@bp.route('/graphs/<name>.<fmt>')
+def chart_image(name, fmt):
+    if name not in CHARTS or fmt not in CHART_FORMATS:
+        abort(404)
+    filters = filter_args(request.args)
+
+    # Unfiltered PNGs come from the latest 'graphs' job, even a stale one (/graphs marks it and queues a
+    # refresh); a job that ran on an empty ledger has no images, so the chart is then rendered here
+    index = list(CHARTS).index(name)
+    latest = job_queue.latest_result('graphs') if not filters and fmt == 'png' else None
+    precomputed = latest is not None and index < len(latest.result.get('graphs', []))
+    version = latest.data_version if precomputed else get_data_version()
+    filter_key = tuple(sorted(filters.items()))
+    ledger_id = current_ledger_id()
+    etag = hashlib.md5(repr((ledger_id, version, name, fmt, filter_key)).encode('utf-8')).hexdigest()
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(etag)
+        return response
+
+    cache_key = (ledger_id, version, name, fmt, filter_key)
+    cached = chart_cache.get(cache_key)
+    if cached is None:
+        if precomputed:
+            body = base64.b64decode(latest.result['graphs'][index])
+            cached = (body, latest.finished_at)
+        else:
+            if filters:
+                rows = filtered_transactions(request.args).with_entities(
+                    Transaction.amount, Transaction.category, Transaction.date)
+            else:
+                with profiler.span('snapshot:load'):
+                    rows = ledger_services().snapshot_store.load().frame(description=False)
+            with profiler.span('chart:frame'):
+                df = chart_frame(rows)
+            cached = (render_chart(name, df, fmt), time.time())
+        chart_cache.put(cache_key, *cached)
+
+    body, last_modified = cached
+    response = make_response(body)
+    response.mimetype = CHART_FORMATS[fmt]
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True  # always revalidate, usually answered with 304
+    return response.make_conditional(request)
+
+@bp.route('/jobs')
+def job_status():
+    return jsonify({
+        'ledger_id': current_ledger_id(),
+        'data_version': get_data_version(),
+        'jobs': job_queue.status(request.args.get('limit', 20, type=int))
+    })
+
+@bp.route('/api/forecasts')
+def api_forecasts():
+    grain = request.args.get('grain', 'week')
+    if grain not in FORECAST_GRAINS:
+        abort(400)
+    horizon = min(max(request.args.get('horizon', DEFAULT_HORIZONS[grain], type=int), 1), MAX_HORIZONS[grain])
+    if horizon == DEFAULT_HORIZONS[grain]:
+        forecasts, stale = latest_or_compute('forecasts', compute_forecasts)
+        forecasts = forecasts[grain]
+    else:
+        forecasts, stale = compute_forecasts(horizons={grain: horizon})[grain], False
+    return jsonify({
+        'grain': grain,
+        'horizon': horizon,
+        'interval_width': INTERVAL_WIDTH,
+        'stale': stale,
+        'forecasts': [dict(entry, category_name=CATEGORIES.get(entry['category'], 'Unknown')
+                           if entry['category'] is not None else 'All categories')
+                      for entry in forecasts]
+    })
+
+@bp.route('/add', methods=['POST'])
 def add_transaction():
     try:
         amount = float(request.form['amount'])
@@ -194,11 +597,12 @@ def add_transaction():
             return redirect('/')
 
         try:
-            input_date = datetime.strptime(transaction_date_str, '%Y-%m-%d').date()
+            # The form sends YYYY-MM-DD; only CSV uploads accept the other formats
+            input_date = datetime.strptime(transaction_date_str, ISO_DATE_FORMAT).date()
             if input_date > date.today():
                 flash("Date cannot be in future")
                 return redirect('/')
-            transaction_date = input_date.isoformat() # Store in 'YYYY-MM-DD' format
+            transaction_date = input_date
         except ValueError:
             flash("Use YYYY-MM-DD date format")
             return redirect('/')
@@ -209,9 +613,18 @@ def add_transaction():
             date=transaction_date,
             description=description
         )
+        duplicate = screen_transaction(new_trans)
+        previous_version = get_data_version()
         db.session.add(new_trans)
+        apply_transaction(new_trans)
         db.session.commit()
+        ledger_services().snapshot_store.record_inserts(new_trans.id - 1, previous_version, previous_version + 1)
         flash("Transaction added successfully!")
+        if duplicate:
+            flash("Note: a transaction with the same date, amount and description already exists")
+        if new_trans.anomaly_score is not None and new_trans.anomaly_score >= current_app.config['ANOMALY_THRESHOLD']:
+            flash(f"Note: ₹{amount:,.2f} is unusually high for {CATEGORIES[category]}")
+        schedule_refresh()
         return redirect('/')
 
     except ValueError:
@@ -221,7 +634,7 @@ def add_transaction():
         flash("Error adding transaction. Please try again.")
         return redirect('/')
 
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
 def upload_csv():
     try:
         if 'csv_file' not in request.files:
@@ -234,68 +647,105 @@ def upload_csv():
             return redirect('/')
 
         if file and file.filename.endswith('.csv'):
-            df = pd.read_csv(io.StringIO(file.stream.read().decode('utf-8')))
-
-            if not all(col in df.columns for col in ['amount', 'category', 'date']):
-                flash('CSV must contain: amount, category, date columns')
-                return redirect('/')
+            started = time.perf_counter()
+            batch_size = current_app.config['UPLOAD_BATCH_SIZE']
+            max_reported_errors = current_app.config['UPLOAD_MAX_REPORTED_ERRORS']
 
+            rows_seen = 0
             success_count = 0
+            chunk_count = 0
+            committed_chunks = 0
+            error_count = 0
             error_rows = []
-            for index, row in df.iterrows():
-                try:
-                    amount = float(row['amount'])
-                    category = int(row['category'])
-                    date_str = str(row['date'])
-                    try:
-                        parsed_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                        transaction_date = parsed_date.isoformat()
-                    except ValueError:
-                        try:
-                            parsed_date = parser.parse(date_str).date()
-                            transaction_date = parsed_date.isoformat()
-                        except ValueError:
-                            error_rows.append(f"Row {index + 2}: Invalid date format '{date_str}'")
-                            continue
-
-                    description = str(row.get('description', ''))
-
-                    new_trans = Transaction(
-                        amount=amount,
-                        category=category,
-                        date=transaction_date,
-                        description=description
-                    )
-                    db.session.add(new_trans)
-                    success_count += 1
-                except (ValueError, TypeError) as e:
-                    error_rows.append(f"Row {index + 2}: Invalid data - {e}")
-                    continue
-
-            db.session.commit()
+            failure = None
+
+            # Each chunk is validated and committed on its own: a failure keeps
+            # every earlier chunk and drops the failing chunk and everything after it
+            screen = UploadScreen(skip_duplicates=current_app.config['UPLOAD_DUPLICATES'] == 'skip',
+                                  threshold=current_app.config['ANOMALY_THRESHOLD'])
+            # New rows get ids above the current maximum; each committed chunk bumps the data version once
+            previous_version = get_data_version()
+            after_id = db.session.query(func.max(Transaction.id)).scalar() or 0
+            try:
+                for chunk in read_csv_chunks(file.stream, current_app.config['UPLOAD_CHUNK_SIZE']):
+                    if rows_seen == 0 and not all(col in chunk.columns for col in REQUIRED_COLUMNS):
+                        flash('CSV must contain: amount, category, date columns')
+                        return redirect('/')
+
+                    with profiler.span('upload:validate', rows=len(chunk)):
+                        clean, chunk_errors = validate_frame(chunk, row_offset=rows_seen)
+                    with profiler.span('upload:detect', rows=len(clean)):
+                        clean = screen.screen(clean)
+                    # A chunk of skipped duplicates or invalid rows changes nothing, so the data version stays
+                    if len(clean):
+                        with profiler.span('upload:insert', rows=len(clean)):
+                            for records in iter_batches(clean, batch_size):
+                                db.session.execute(Transaction.__table__.insert(), records)
+                        with profiler.span('upload:aggregates', rows=len(clean)):
+                            apply_transactions(clean)
+                        with profiler.span('upload:commit'):
+                            db.session.commit()
+                        committed_chunks += 1
+
+                    chunk_count += 1
+                    success_count += len(clean)
+                    error_count += len(chunk_errors)
+                    error_rows.extend(chunk_errors[:max(max_reported_errors - len(error_rows), 0)])
+                    current_app.logger.info("CSV upload: processed chunk %d (rows %d-%d, %d accepted)",
+                                    chunk_count, rows_seen + 2, rows_seen + len(chunk) + 1, len(clean))
+                    rows_seen += len(chunk)
+            except Exception as e:
+                db.session.rollback()
+                failure = f"Import stopped at row {rows_seen + 2}: {str(e).strip() or type(e).__name__}"
+
+            if committed_chunks:
+                ledger_services().snapshot_store.record_inserts(after_id, previous_version,
+                                                                previous_version + committed_chunks)
+                schedule_refresh()
+
+            elapsed = time.perf_counter() - started
+            rows_per_second = rows_seen / elapsed if elapsed > 0 else float(rows_seen)
             flash(f'Successfully added {success_count} transactions from CSV!')
+            flash(f'Processed {rows_seen} rows in {chunk_count} chunks, {elapsed:.2f}s ({rows_per_second:,.0f} rows/sec)')
+            if failure:
+                flash(f"{failure}. The {success_count} transactions before it were saved; "
+                      "that row and all later rows were not imported.")
+            if screen.duplicates:
+                if screen.skip_duplicates:
+                    flash(f"Skipped {screen.duplicates} rows that are already in this ledger (an earlier import of the same statement?)")
+                else:
+                    flash(f"Imported {screen.duplicates} rows that look like duplicates of transactions already in this ledger")
+            if screen.anomalies:
+                flash(f"Flagged {screen.anomalies} transactions with unusual amounts for their category")
             if error_rows:
-                flash("<br>The following rows had errors and were skipped:<br>" + "<br>".join(error_rows))
-            return redirect('/')
+                hidden = error_count - len(error_rows)
+                more = f"<br>...and {hidden} more" if hidden else ""
+                flash("<br>The following rows had errors and were skipped:<br>" + "<br>".join(error_rows) + more)
+            response = redirect('/')
+            response.headers['X-Rows-Per-Second'] = f'{rows_per_second:.0f}'
+            return response
         else:
             flash('Please upload a CSV file')
             return redirect('/')
     except Exception as e:
+        db.session.rollback()
         flash('Error processing CSV file')
         return redirect('/')
 
-@app.route('/delete/<int:transaction_id>', methods=['POST'])
+@bp.route('/delete/<int:transaction_id>', methods=['POST'])
 def delete_transaction(transaction_id):
     try:
-        transaction = Transaction.query.get_or_404(transaction_id)
+        transaction = Transaction.query.filter_by(id=transaction_id, ledger_id=current_ledger_id()).first_or_404()
         db.session.delete(transaction)
+        apply_transaction(transaction, sign=-1)
         db.session.commit()
+        ledger_services().snapshot_store.record_deletes([transaction_id])
         flash("Transaction deleted successfully!")
+        schedule_refresh()
     except:
         flash("Error deleting transaction.")
     return redirect(request.referrer or '/')
 
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+    # Development server; see gunicorn.conf.py for serving with several workers
+    create_app().run(debug=os.environ.get('FLASK_DEBUG') == '1', threaded=True)
\ No newline at end of file
@@ -0,0 +1,677 @@
+"""Benchmark harness for the expense tracker.
+
+Generates synthetic ledgers, loads them into a throwaway SQLite database and
+times date parsing, the upload path, the FinanceAdvisor stages, chart
+rendering and the read routes. Every ledger size runs in its own spawned process so memory
+figures are not polluted by earlier sizes.
+
+    python benchmark.py run --sizes 10000 100000 --repeats 5 --output before.json
+    python benchmark.py compare before.json after.json
+
+The load test serves the app from a threaded server and measures read
+latency while a large CSV upload commits, once with the tuned SQLite settings
+and once with SQLite's defaults (rollback journal, small page cache):
+
+    python benchmark.py load --rows 100000 --upload-rows 500000 --settings tuned legacy
+
+The startup benchmark times a cold worker: importing app, create_app and the
+first /add, /delete and / requests, each repeat in a fresh interpreter, and
+lists the heavy modules loaded after every step:
+
+    python benchmark.py startup --repeats 10
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Share of transactions per category, roughly a household budget
+CATEGORY_WEIGHTS: Dict[int, float] = {1: 0.30, 2: 0.12, 3: 0.12, 4: 0.15, 6: 0.06, 7: 0.15, 8: 0.10}
+
+# (median amount, spread) of the log-normal amount distribution per category
+CATEGORY_AMOUNTS: Dict[int, tuple] = {
+    1: (900.0, 0.6), 2: (600.0, 0.8), 3: (1200.0, 0.9), 4: (350.0, 0.7),
+    6: (2500.0, 1.0), 7: (1800.0, 0.4), 8: (500.0, 1.1),
+}
+
+MERCHANTS: Dict[int, List[str]] = {
+    1: ['Supermarket', 'Vegetable market', 'Bakery', 'Dairy store', 'Online groceries'],
+    2: ['Movie tickets', 'Streaming subscription', 'Concert', 'Dinner out', 'Gaming'],
+    3: ['Cleaning supplies', 'Kitchenware', 'Furniture', 'Home repair', 'Bedding'],
+    4: ['Fuel', 'Metro card', 'Cab ride', 'Bus pass', 'Parking'],
+    6: ['Course fee', 'Books', 'Stationery', 'Exam fee', 'Online class'],
+    7: ['Electricity bill', 'Water bill', 'Internet', 'Mobile recharge', 'Gas cylinder'],
+    8: ['Gift', 'Donation', 'Pharmacy', 'Salon', 'Miscellaneous'],
+}
+
+BAD_DATES = ['31/02/2023', 'not a date', '2023-13-01', '']
+BAD_CATEGORIES = ['x', '2.5', '']
+
+DEFAULT_SIZES = [10000, 100000]
+
+# Row-by-row dateutil parsing is slow; its per-row cost is measured on at most this many rows
+LEGACY_DATE_SAMPLE = 100000
+
+# Formats mixed into the 'mixed formats' date case, one row in five
+ALTERNATE_DATE_FORMATS = ['%d/%m/%Y', '%d %b %Y', '%B %d, %Y', '%Y%m%d']
+
+ROUTES = [
+    '/',
+    '/all-transactions',
+    '/api/transactions?page_size=50',
+    '/api/search?q=sup',
+    '/api/search?q=online%20gro&category=1',
+    '/api/search?q=exam&category=6&category=8',
+    '/all-transactions?q=bill',
+    '/graphs',
+    '/graphs/monthly-trend.png',
+    '/graphs/category-share.json',
+    '/api/forecasts?grain=week',
+    '/api/forecasts?grain=month&horizon=6',
+]
+
+# Routes polled by the load test's reader threads
+LOAD_TEST_ROUTES = ['/', '/all-transactions']
+
+# SQLite's own defaults, which the app ran with before models.SQLITE_PRAGMAS; the load test's baseline
+LEGACY_SQLITE_PRAGMAS: Dict[str, object] = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'busy_timeout': 5000,  # the sqlite3 module's default timeout
+    'cache_size': -2000,
+    'temp_store': 'DEFAULT',
+    'mmap_size': 0,
+}
+
+# Modules whose presence the startup benchmark reports after each step
+STARTUP_MODULES = ['numpy', 'pandas', 'dateutil', 'matplotlib', 'scipy', 'sklearn', 'joblib', 'prophet']
+
+# Run by the startup benchmark in a fresh interpreter; prints [step, seconds, loaded modules, peak RSS]
+# per step. argv holds STARTUP_MODULES
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+steps = []
+
+def step(name, func):
+    started = time.perf_counter()
+    result = func()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    steps.append([name, time.perf_counter() - started, [m for m in sys.argv[1:] if m in sys.modules],
+                  peak if sys.platform == 'darwin' else peak * 1024])
+    return result
+
+app_module = step('import app', lambda: __import__('app'))
+app = step('create_app', app_module.create_app)
+client = app.test_client()
+step('POST /add', lambda: client.post('/add', data={'amount': '12.50', 'category': '1',
+                                                    'date': '2024-01-15', 'description': 'startup'}))
+step('POST /delete', lambda: client.post('/delete/1'))
+step('GET /', lambda: client.get('/'))
+print(json.dumps(steps))
+'''
+
+
+def generate_ledger(rows: int, seed: int = 42, years: int = 3,
+                    bad_date_rate: float = 0.002, bad_category_rate: float = 0.001) -> pd.DataFrame:
+    """A synthetic ledger shaped like the upload CSV (amount, category, date, description).
+
+    Spending follows a yearly cycle peaking around December and is heavier on
+    weekends; a small share of rows carries malformed dates or categories so
+    the validation paths are exercised too.
+    """
+    rng = np.random.default_rng(seed)
+    end = date.today()
+    days = np.array([end - timedelta(days=offset) for offset in range(years * 365)])
+    day_index = pd.DatetimeIndex(days)
+    seasonality = 1.0 + 0.25 * np.cos(2 * np.pi * (day_index.dayofyear.to_numpy() - 350) / 365.25)
+    weekday = np.where(day_index.dayofweek >= 5, 1.4, 1.0)
+    weights = seasonality * weekday
+    picked_days = rng.choice(len(days), size=rows, p=weights / weights.sum())
+
+    category_ids = np.array(list(CATEGORY_WEIGHTS))
+    categories = rng.choice(category_ids, size=rows, p=np.array(list(CATEGORY_WEIGHTS.values())))
+    medians = np.array([CATEGORY_AMOUNTS[c][0] for c in category_ids])
+    spreads = np.array([CATEGORY_AMOUNTS[c][1] for c in category_ids])
+    position = np.searchsorted(category_ids, categories)
+    amounts = np.round(medians[position] * np.exp(rng.normal(0.0, spreads[position])), 2)
+
+    merchant_pick = rng.integers(0, 5, size=rows)
+    descriptions = [MERCHANTS[c][m] for c, m in zip(categories, merchant_pick)]
+
+    ledger = pd.DataFrame({
+        'amount': amounts,
+        'category': categories.astype(object),
+        'date': day_index[picked_days].strftime('%Y-%m-%d'),
+        'description': descriptions,
+    })
+    bad_dates = rng.random(rows) < bad_date_rate
+    ledger.loc[bad_dates, 'date'] = rng.choice(BAD_DATES, size=int(bad_dates.sum()))
+    bad_categories = rng.random(rows) < bad_category_rate
+    ledger.loc[bad_categories, 'category'] = rng.choice(BAD_CATEGORIES, size=int(bad_categories.sum()))
+    return ledger
+
+
+def write_ledger_csv(path: str, rows: int, seed: int = 42, chunk_rows: int = 1_000_000) -> None:
+    # Generated and written chunk by chunk so 10M-row ledgers do not need 10M rows in memory
+    written = 0
+    with open(path, 'w', newline='') as handle:
+        while written < rows:
+            size = min(chunk_rows, rows - written)
+            generate_ledger(size, seed=seed + written).to_csv(handle, index=False, header=written == 0)
+            written += size
+
+
+def _summarize(case: str, rows: int, timings: List[float], peak_alloc: Optional[int]) -> Dict:
+    timings_ms = np.array(timings) * 1000.0
+    mean_seconds = float(np.mean(timings))
+    return {
+        'case': case,
+        'rows': rows,
+        'repeats': len(timings),
+        'mean_ms': round(float(timings_ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(timings_ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(timings_ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(timings_ms, 99)), 3),
+        'rows_per_sec': round(rows / mean_seconds, 1) if mean_seconds > 0 and rows else None,
+        'us_per_row': round(mean_seconds * 1e6 / rows, 3) if rows else None,
+        'peak_alloc_mb': round(peak_alloc / 2**20, 2) if peak_alloc is not None else None,
+        'peak_rss_mb': round(_peak_rss_bytes() / 2**20, 2),
+    }
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _measure(case: str, rows: int, func: Callable[[], object], repeats: int,
+             setup: Optional[Callable[[], None]] = None, trace_memory: bool = True) -> Dict:
+    timings = []
+    for _ in range(repeats):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    # One extra, untimed pass under tracemalloc for the allocation high-water mark
+    peak_alloc = None
+    if trace_memory:
+        if setup:
+            setup()
+        tracemalloc.start()
+        func()
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    result = _summarize(case, rows, timings, peak_alloc)
+    print(f"  {case:<40} p50 {result['p50_ms']:>10.1f} ms  p90 {result['p90_ms']:>10.1f} ms  "
+          f"{result['rows_per_sec'] or 0:>14,.0f} rows/s  {result['us_per_row'] or 0:>9.2f} us/row", flush=True)
+    return result
+
+
+def _legacy_parse_dates(values) -> pd.Series:
+    # How dates were parsed before dates.py: one dateutil call per row
+    from dateutil.parser import parse
+    parsed = []
+    for value in values:
+        try:
+            parsed.append(parse(str(value)).date())
+        except (ValueError, TypeError, OverflowError):
+            parsed.append(None)
+    return pd.to_datetime(pd.Series(parsed), errors='coerce')
+
+
+def _mixed_format_dates(raw_dates: pd.Series, seed: int) -> pd.Series:
+    # Every fifth row rewritten in one of the alternate formats the flexible parser has to handle
+    rng = np.random.default_rng(seed)
+    mixed = raw_dates.astype(object).copy()
+    parsed = pd.to_datetime(raw_dates, format='%Y-%m-%d', errors='coerce')
+    picked = (rng.random(len(mixed)) < 0.2) & parsed.notna().to_numpy()
+    formats = rng.choice(ALTERNATE_DATE_FORMATS, size=int(picked.sum()))
+    mixed[picked] = [timestamp.strftime(fmt) for timestamp, fmt in zip(parsed[picked], formats)]
+    return mixed
+
+
+def benchmark_dates(csv_path: str, repeats: int, seed: int) -> List[Dict]:
+    """Per-row cost of the old row-by-row parsing against dates.normalize_dates."""
+    import dates
+    raw_dates = pd.read_csv(csv_path, usecols=['date'])['date']
+    legacy_sample = raw_dates.iloc[:LEGACY_DATE_SAMPLE]
+    date_objects = list(dates.normalize_dates(raw_dates).dropna().dt.date)
+    mixed = _mixed_format_dates(raw_dates, seed)
+    cold = dates._parse_flexible.cache_clear  # every timed run starts without memoized strings
+    return [
+        _measure('dates:per-row dateutil', len(legacy_sample),
+                 lambda: _legacy_parse_dates(legacy_sample), repeats),
+        _measure('dates:normalize_dates', len(raw_dates),
+                 lambda: dates.normalize_dates(raw_dates), repeats, setup=cold),
+        _measure('dates:normalize_dates(mixed formats)', len(mixed),
+                 lambda: dates.normalize_dates(mixed), repeats, setup=cold),
+        _measure('dates:normalize_dates(date objects)', len(date_objects),
+                 lambda: dates.normalize_dates(date_objects), repeats),
+    ]
+
+
+def _wait_for_jobs(timeout: float = 600.0) -> None:
+    from sqlalchemy import inspect
+    from models import Job, db
+    if not inspect(db.engine).has_table(Job.__tablename__):
+        return
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not Job.query.filter(Job.status.in_(['queued', 'running'])).count():
+            return
+        time.sleep(0.2)
+
+
+def run_size(rows: int, repeats: int, cases: List[str], seed: int) -> List[Dict]:
+    """Benchmark one ledger size; runs in a fresh process with its own temporary database."""
+    workdir = tempfile.mkdtemp(prefix='expense-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['MODEL_DIR'] = os.path.join(workdir, 'models')
+    os.environ['SNAPSHOT_DIR'] = os.path.join(workdir, 'snapshot')
+
+    import app as app_module
+    from aggregates import load_rollups, rebuild_aggregates
+    from charts import generate_graphs
+    from finance_advisor import FinanceAdvisor
+    from ingest import iter_batches, validate_frame
+    from models import Transaction, db, init_db
+    from transaction_batch import TransactionBatch
+
+    app = app_module.create_app()
+    client = app.test_client()
+    with app.app_context():
+        snapshot_store = app_module.ledger_services().snapshot_store  # the default ledger's
+    csv_path = os.path.join(workdir, 'ledger.csv')
+    write_ledger_csv(csv_path, rows, seed)
+    results: List[Dict] = []
+    print(f"{rows:,} rows", flush=True)
+
+    def reset_database():
+        with app.app_context():
+            _wait_for_jobs()  # jobs queued by the previous upload must not race the drop
+            db.drop_all()
+            init_db()
+
+    def upload():
+        with open(csv_path, 'rb') as handle:
+            client.post('/upload', data={'csv_file': (handle, 'ledger.csv')},
+                        content_type='multipart/form-data')
+
+    if 'dates' in cases:
+        results.extend(benchmark_dates(csv_path, repeats, seed))
+
+    if 'upload' in cases:
+        results.append(_measure('route:/upload', rows, upload, repeats, setup=reset_database, trace_memory=False))
+
+    # Load the ledger once for every read benchmark
+    reset_database()
+    with app.app_context():
+        clean, _ = validate_frame(pd.read_csv(csv_path))
+        for records in iter_batches(clean):
+            db.session.execute(Transaction.__table__.insert(), records)
+        db.session.commit()
+        rebuild_aggregates()
+        stored_rows = db.session.query(Transaction).count()
+
+        if 'snapshot' in cases:
+            results.append(_measure('snapshot:rebuild', stored_rows,
+                                    lambda: (snapshot_store.clear(), snapshot_store.load()), repeats))
+            results.append(_measure('snapshot:load', stored_rows, snapshot_store.load, repeats))
+
+    with app.app_context():
+        if 'advisor' in cases:
+            transactions = Transaction.query.all()
+            results.append(_measure('advisor:__init__', stored_rows,
+                                    lambda: FinanceAdvisor(transactions), repeats))
+            # Query included: ORM objects against column arrays straight from the cursor
+            results.append(_measure('advisor:__init__(orm query)', stored_rows,
+                                    lambda: FinanceAdvisor(Transaction.query.all()), repeats))
+            results.append(_measure('advisor:__init__(batch query)', stored_rows,
+                                    lambda: FinanceAdvisor(TransactionBatch.from_query(Transaction.query)), repeats))
+            results.append(_measure('advisor:__init__(snapshot)', stored_rows,
+                                    lambda: FinanceAdvisor(snapshot_store.load().frame()), repeats))
+            advisor = FinanceAdvisor(transactions)
+            for method in ('_analyze_weekly_spending', '_analyze_spending_by_category',
+                           '_perform_kmeans_clustering', '_predict_spending_trend',
+                           '_generate_budget_recommendations'):
+                def call(method=method):
+                    # Fitted models and forecasts are cached on the instance; clear them so every run fits
+                    advisor.kmeans_model = advisor.forecasts = None
+                    getattr(advisor, method)()
+                results.append(_measure(f"advisor:{method}", stored_rows, call, repeats))
+            results.append(_measure('advisor:generate_insights', stored_rows,
+                                    lambda: FinanceAdvisor(transactions).generate_insights(), repeats))
+            results.append(_measure('advisor:generate_insights(aggregates)', stored_rows,
+                                    lambda: FinanceAdvisor([], aggregates=load_rollups(),
+                                                           inference_only=True).generate_insights(),
+                                    repeats))
+            del transactions, advisor
+
+        if 'graphs' in cases:
+            chart_rows = Transaction.query.with_entities(
+                Transaction.amount, Transaction.category, Transaction.date).all()
+            results.append(_measure('generate_graphs', stored_rows,
+                                    lambda: generate_graphs(chart_rows, processes=1), repeats))
+            results.append(_measure('generate_graphs(snapshot)', stored_rows,
+                                    lambda: generate_graphs(snapshot_store.load().frame(description=False),
+                                                            processes=1), repeats))
+            del chart_rows
+
+        if 'routes' in cases:
+            app_module.schedule_refresh()
+            _wait_for_jobs()
+            for route in ROUTES:
+                results.append(_measure(f"route:{route}", stored_rows,
+                                        lambda route=route: client.get(route), repeats))
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def _multipart_csv(path: str):
+    # The upload form's body, built by hand so the load test needs no HTTP client library
+    boundary = f"benchmark-{os.getpid()}"
+    with open(path, 'rb') as handle:
+        csv_bytes = handle.read()
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="csv_file"; filename="upload.csv"\r\n'
+            'Content-Type: text/csv\r\n\r\n').encode()
+    return head + csv_bytes + f'\r\n--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+
+def run_load_test(settings: str, rows: int, upload_rows: int, readers: int,
+                  idle_seconds: float, seed: int) -> List[Dict]:
+    """Read latency of LOAD_TEST_ROUTES while idle and during a large upload.
+
+    Runs in a fresh process: the app is served by a threaded werkzeug server
+    over a ledger of ``rows`` transactions. ``readers`` threads poll the
+    routes over HTTP while one client posts an ``upload_rows`` CSV.
+    ``settings`` is 'tuned' (models.SQLITE_PRAGMAS) or 'legacy'
+    (LEGACY_SQLITE_PRAGMAS).
+    """
+    workdir = tempfile.mkdtemp(prefix='expense-load-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    os.environ['MODEL_DIR'] = os.path.join(workdir, 'models')
+    os.environ['SNAPSHOT_DIR'] = os.path.join(workdir, 'snapshot')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+    import app as app_module
+    from aggregates import rebuild_aggregates
+    from ingest import iter_batches, validate_frame
+    from models import Transaction, configure_sqlite, db
+    from werkzeug.serving import make_server
+
+    app = app_module.create_app()
+    if settings == 'legacy':
+        configure_sqlite(**LEGACY_SQLITE_PRAGMAS)  # create_app closed its connections, so every new one gets these
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    base_path = os.path.join(workdir, 'base.csv')
+    upload_path = os.path.join(workdir, 'upload.csv')
+    write_ledger_csv(base_path, rows, seed)
+    write_ledger_csv(upload_path, upload_rows, seed + rows)
+    with app.app_context():
+        clean, _ = validate_frame(pd.read_csv(base_path))
+        for records in iter_batches(clean):
+            db.session.execute(Transaction.__table__.insert(), records)
+        db.session.commit()
+        rebuild_aggregates()
+    upload_body, content_type = _multipart_csv(upload_path)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    for route in LOAD_TEST_ROUTES:
+        urllib.request.urlopen(base_url + route).read()  # first views compute insights inline
+    with app.app_context():
+        _wait_for_jobs()
+
+    phase = ['idle']
+    timings: Dict[tuple, List[float]] = {(route, name): [] for route in LOAD_TEST_ROUTES for name in ('idle', 'upload')}
+    errors: Dict[tuple, int] = {key: 0 for key in timings}
+    stop = threading.Event()
+
+    def read(route: str) -> None:
+        while not stop.is_set():
+            current = phase[0]
+            started = time.perf_counter()
+            try:
+                urllib.request.urlopen(base_url + route, timeout=600).read()
+            except OSError:
+                errors[(route, current)] += 1
+                continue
+            if current == phase[0]:  # requests straddling the start or end of the upload are dropped
+                timings[(route, current)].append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=read, args=(LOAD_TEST_ROUTES[index % len(LOAD_TEST_ROUTES)],), daemon=True)
+               for index in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(idle_seconds)
+
+    phase[0] = 'upload'
+    connection = http.client.HTTPConnection('127.0.0.1', server.server_port, timeout=3600)
+    started = time.perf_counter()
+    connection.request('POST', '/upload', upload_body, {'Content-Type': content_type})
+    connection.getresponse().read()
+    upload_seconds = time.perf_counter() - started
+    phase[0] = 'done'
+    stop.set()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    print(f"{settings}: {rows:,} rows, uploading {upload_rows:,} rows took {upload_seconds:.1f}s", flush=True)
+    results = [_summarize(f"load:/upload [{settings}]", upload_rows, [upload_seconds], None)]
+    for (route, name), samples in timings.items():
+        if not samples:
+            print(f"  {route:<20} {name:<7} no completed requests ({errors[(route, name)]} errors)", flush=True)
+            continue
+        result = _summarize(f"load:{route} {name} [{settings}]", rows, samples, None)
+        result['max_ms'] = round(max(samples) * 1000.0, 3)
+        result['requests'] = len(samples)
+        result['errors'] = errors[(route, name)]
+        results.append(result)
+        print(f"  {route:<20} {name:<7} {len(samples):>6} requests  p50 {result['p50_ms']:>9.1f} ms  "
+              f"p99 {result['p99_ms']:>9.1f} ms  max {result['max_ms']:>9.1f} ms  {result['errors']} errors", flush=True)
+    with app.app_context():
+        _wait_for_jobs()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def run_startup(repeats: int) -> List[Dict]:
+    """Time a cold start step by step; every repeat is a new interpreter with an empty database."""
+    timings: Dict[str, List[float]] = {}
+    loaded: Dict[str, List[str]] = {}
+    peak_rss: Dict[str, int] = {}
+    for _ in range(repeats):
+        workdir = tempfile.mkdtemp(prefix='expense-startup-')
+        env = dict(os.environ,
+                   DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+                   MODEL_DIR=os.path.join(workdir, 'models'),
+                   SNAPSHOT_DIR=os.path.join(workdir, 'snapshot'),
+                   SECRET_KEY='benchmark',
+                   FLASK_JOB_WORKERS='0')  # background jobs would import the stack mid-measurement
+        try:
+            output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT, *STARTUP_MODULES],
+                                             cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        for name, seconds, modules, rss in json.loads(output.decode().splitlines()[-1]):
+            timings.setdefault(name, []).append(seconds)
+            loaded[name] = modules
+            peak_rss[name] = max(peak_rss.get(name, 0), rss)
+
+    results: List[Dict] = []
+    for name, step_timings in timings.items():
+        result = _summarize(f'startup:{name}', 0, step_timings, None)
+        result['peak_rss_mb'] = round(peak_rss[name] / 2**20, 2)  # the child's, not this process's
+        result['modules_loaded'] = loaded[name]
+        print(f"  {result['case']:<40} p50 {result['p50_ms']:>10.1f} ms  p90 {result['p90_ms']:>10.1f} ms  "
+              f"rss {result['peak_rss_mb']:>7.1f} MB  loaded: {', '.join(loaded[name]) or 'none'}", flush=True)
+        results.append(result)
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> None:
+    cases = args.cases.split(',')
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'sizes': args.sizes,
+            'repeats': args.repeats,
+            'seed': args.seed,
+            'cases': cases,
+        },
+        'results': [],
+    }
+    spawn = multiprocessing.get_context('spawn')
+    for rows in args.sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            report['results'].extend(executor.submit(run_size, rows, args.repeats, cases, args.seed).result())
+
+    output = args.output or f"benchmark-{report['meta']['commit'] or 'local'}.json"
+    with open(output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Report written to {output}")
+
+
+def load(args) -> None:
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'rows': args.rows,
+            'upload_rows': args.upload_rows,
+            'readers': args.readers,
+            'settings': args.settings,
+            'seed': args.seed,
+        },
+        'results': [],
+    }
+    spawn = multiprocessing.get_context('spawn')
+    for settings in args.settings:
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+            report['results'].extend(executor.submit(
+                run_load_test, settings, args.rows, args.upload_rows, args.readers,
+                args.idle_seconds, args.seed).result())
+
+    output = args.output or f"loadtest-{report['meta']['commit'] or 'local'}.json"
+    with open(output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Report written to {output}")
+
+
+def startup(args) -> None:
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeats': args.repeats,
+        },
+        'results': run_startup(args.repeats),
+    }
+    output = args.output or f"startup-{report['meta']['commit'] or 'local'}.json"
+    with open(output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Report written to {output}")
+
+
+def compare(args) -> None:
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.candidate) as handle:
+        candidate = json.load(handle)
+    before = {(r['case'], r['rows']): r for r in baseline['results']}
+    print(f"{'case':<40} {'rows':>10} {'before p50':>12} {'after p50':>12} {'speedup':>8}")
+    for result in candidate['results']:
+        previous = before.get((result['case'], result['rows']))
+        if previous is None:
+            continue
+        speedup = previous['p50_ms'] / result['p50_ms'] if result['p50_ms'] else float('inf')
+        print(f"{result['case']:<40} {result['rows']:>10,} {previous['p50_ms']:>10.1f}ms "
+              f"{result['p50_ms']:>10.1f}ms {speedup:>7.2f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and write a JSON report')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                            help='ledger sizes in rows (default: %(default)s)')
+    run_parser.add_argument('--repeats', type=int, default=5, help='timed runs per case')
+    run_parser.add_argument('--cases', default='dates,upload,snapshot,advisor,graphs,routes',
+                            help='comma-separated groups: dates, upload, snapshot, advisor, graphs, routes')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--output', help='report path (default: benchmark-<commit>.json)')
+    run_parser.set_defaults(handler=run)
+
+    load_parser = commands.add_parser('load', help='measure read latency during a large upload')
+    load_parser.add_argument('--rows', type=int, default=100000, help='transactions loaded before the test')
+    load_parser.add_argument('--upload-rows', type=int, default=500000, help='rows in the uploaded CSV')
+    load_parser.add_argument('--readers', type=int, default=4, help='threads polling the read routes')
+    load_parser.add_argument('--idle-seconds', type=float, default=5.0, help='baseline reads before the upload')
+    load_parser.add_argument('--settings', nargs='+', choices=['tuned', 'legacy'], default=['tuned', 'legacy'],
+                             help='SQLite settings to compare (default: %(default)s)')
+    load_parser.add_argument('--seed', type=int, default=42)
+    load_parser.add_argument('--output', help='report path (default: loadtest-<commit>.json)')
+    load_parser.set_defaults(handler=load)
+
+    startup_parser = commands.add_parser('startup', help='time a cold start and the first requests')
+    startup_parser.add_argument('--repeats', type=int, default=10, help='fresh interpreters started')
+    startup_parser.add_argument('--output', help='report path (default: startup-<commit>.json)')
+    startup_parser.set_defaults(handler=startup)
+
+    compare_parser = commands.add_parser('compare', help='compare the p50 latencies of two reports')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
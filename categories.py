@@ -0,0 +1,12 @@
+from typing import Dict
+
+# Define constants for category mapping
+CATEGORIES: Dict[int, str] = {
+    1: "Groceries",
+    2: "Entertainment",
+    3: "Household",
+    4: "Transportation",
+    6: "Education",
+    7: "Utilities",
+    8: "Others"
+}
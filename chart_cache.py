@@ -0,0 +1,41 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+# Default memory budget for rendered charts
+DEFAULT_MAX_BYTES: int = 32 * 1024 * 1024
+
+
+class ChartCache:
+    """Size-bounded LRU cache of rendered chart bodies.
+
+    Keys include the data version the chart was rendered from, so writes
+    never need to invalidate entries explicitly: charts for old versions are
+    simply no longer requested and age out of the LRU order.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[Hashable, Tuple[bytes, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Tuple[bytes, float]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Hashable, body: bytes, last_modified: float) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self._entries[key] = (body, last_modified)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import base64
+import json
+import time
+from io import BytesIO
+from typing import TYPE_CHECKING, Dict, Iterable, List, Tuple
+
+from dates import normalize_dates
+from categories import CATEGORIES
+from process_pool import DEFAULT_POOL_PROCESSES, get_process_pool
+from profiling import profiler
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.figure import Figure
+
+# Chart name -> title, in display order
+CHARTS: Dict[str, str] = {
+    'monthly-trend': "Monthly Spending Trend",
+    'category-share': "Spending by Category",
+    'weekday-pattern': "Weekly Spending Pattern",
+    'month-of-year': "Monthly Spending Trend",
+}
+
+CHART_FORMATS: Dict[str, str] = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+    'json': 'application/json',
+}
+
+# Worker processes used when several charts are rendered together
+DEFAULT_RENDER_PROCESSES: int = DEFAULT_POOL_PROCESSES
+
+DAY_ORDER = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTH_ORDER = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
+
+def _new_figure() -> Figure:
+    # matplotlib is imported on the first render, not with the app. Agg is selected
+    # explicitly so no interactive backend is ever probed, in the app or in render workers
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    return Figure(figsize=(12, 6))
+
+
+def chart_frame(rows) -> pd.DataFrame:
+    # rows: a DataFrame (e.g. Snapshot.frame()), or (amount, category, date) tuples or objects with those attributes
+    import pandas as pd
+    if isinstance(rows, pd.DataFrame):
+        df = rows.loc[:, ['amount', 'category', 'date']]
+    else:
+        df = pd.DataFrame([(r.amount, r.category, r.date) for r in rows], columns=['amount', 'category', 'date'])
+    df['date'] = normalize_dates(df['date'])  # Invalid dates become NaT
+    df.dropna(subset=['date'], inplace=True)  # Remove rows with invalid dates
+    return df
+
+
+def chart_series(df: pd.DataFrame, names: Iterable[str] = CHARTS) -> Dict[str, pd.Series]:
+    """Compute the aggregation behind each requested chart from one shared, unmodified frame."""
+    import pandas as pd
+    series: Dict[str, pd.Series] = {}
+    for name in names:
+        if name == 'monthly-trend':
+            series[name] = df.groupby(pd.Grouper(key='date', freq='M'))['amount'].sum()
+        elif name == 'category-share':
+            series[name] = df.groupby(df['category'].map(CATEGORIES).rename('category_name'))['amount'].sum()
+        elif name == 'weekday-pattern':
+            day_of_week = pd.Categorical(df['date'].dt.day_name(), categories=DAY_ORDER, ordered=True)
+            series[name] = df.groupby(day_of_week)['amount'].sum()
+        elif name == 'month-of-year':
+            month = pd.Categorical(df['date'].dt.month_name(), categories=MONTH_ORDER, ordered=True)
+            series[name] = df.groupby(month)['amount'].sum()
+        else:
+            raise KeyError(name)
+    return series
+
+
+def _monthly_trend_figure(series: pd.Series) -> Figure:
+    fig = _new_figure()
+    ax = fig.subplots()
+    ax.plot(series.index, series.values, color='#3498db')
+    ax.set_title('Monthly Spending Trend')
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Total Spending")
+    ax.grid(True)
+    return fig
+
+
+def _category_share_figure(series: pd.Series) -> Figure:
+    fig = _new_figure()
+    ax = fig.subplots()
+    ax.pie(
+        series.values,
+        labels=series.index,
+        autopct='%1.1f%%',
+        startangle=90,
+        wedgeprops={'linewidth': 1, 'edgecolor': 'white'}
+    )
+    ax.set_title('Spending by Category')
+    return fig
+
+
+def _bar_figure(series: pd.Series, title: str, xlabel: str, color: str) -> Figure:
+    fig = _new_figure()
+    ax = fig.subplots()
+    ax.bar([str(label) for label in series.index], series.values, color=color)
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel("Total Spending")
+    return fig
+
+
+def _build_figure(name: str, series: pd.Series) -> Figure:
+    if name == 'monthly-trend':
+        return _monthly_trend_figure(series)
+    if name == 'category-share':
+        return _category_share_figure(series)
+    if name == 'weekday-pattern':
+        return _bar_figure(series, 'Weekly Spending Pattern', "Day of the Week", '#2ecc71')
+    if name == 'month-of-year':
+        return _bar_figure(series, 'Monthly Spending Trend', "Month", '#9b59b6')
+    raise KeyError(name)
+
+
+def render_series(name: str, series: pd.Series, fmt: str = 'png') -> bytes:
+    """Render one aggregated series as PNG or SVG bytes, or as JSON labels/values for client-side drawing.
+
+    Uses its own Agg-backed Figure rather than pyplot's global state, so it
+    is safe to call from threads and from worker processes.
+    """
+    if fmt == 'json':
+        import pandas as pd
+        labels = [label.strftime('%Y-%m') if isinstance(label, pd.Timestamp) else str(label)
+                  for label in series.index]
+        return json.dumps({'name': name, 'title': CHARTS[name], 'labels': labels,
+                           'values': [float(value) for value in series.values]}).encode('utf-8')
+
+    fig = _build_figure(name, series)
+    fig.tight_layout()
+    img = BytesIO()
+    fig.savefig(img, format=fmt, dpi=100)
+    return img.getvalue()
+
+
+def _timed_render(name: str, series: pd.Series, fmt: str) -> Tuple[bytes, float]:
+    # Timed inside the worker process; the parent records the span
+    started = time.perf_counter()
+    body = render_series(name, series, fmt)
+    return body, time.perf_counter() - started
+
+
+def render_chart(name: str, df: pd.DataFrame, fmt: str = 'png') -> bytes:
+    with profiler.span('chart:aggregate', rows=len(df)):
+        series = chart_series(df, [name])[name]
+    with profiler.span(f'chart:{name}'):
+        return render_series(name, series, fmt)
+
+
+def render_charts(df: pd.DataFrame, fmt: str = 'png',
+                  processes: int = DEFAULT_RENDER_PROCESSES) -> Dict[str, bytes]:
+    """Render every chart, concurrently across ``processes`` worker processes when more than one."""
+    with profiler.span('chart:aggregate', rows=len(df)):
+        series = chart_series(df)
+    if processes <= 1:
+        rendered = {name: _timed_render(name, values, fmt) for name, values in series.items()}
+    else:
+        executor = get_process_pool(processes)
+        futures = {name: executor.submit(_timed_render, name, values, fmt) for name, values in series.items()}
+        rendered = {name: future.result() for name, future in futures.items()}
+    for name, (_, seconds) in rendered.items():
+        profiler.record(f'chart:{name}', seconds)
+    return {name: body for name, (body, _) in rendered.items()}
+
+
+def generate_graphs(transactions, processes: int = DEFAULT_RENDER_PROCESSES) -> Tuple[List[str], List[str]]:
+    df = chart_frame(transactions)
+
+    graphs = []
+    titles = []
+
+    if df.empty:
+        return graphs, titles
+
+    rendered = render_charts(df, 'png', processes)
+    for name, title in CHARTS.items():
+        graphs.append(base64.b64encode(rendered[name]).decode('utf-8'))
+        titles.append(title)
+    return graphs, titles
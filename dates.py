@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+from datetime import date, datetime
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable, Optional, Union
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# parse_date runs on every form submission, so numpy, pandas and dateutil are only
+# imported by the functions that need them
+
+# Format dates are stored, submitted and exported in
+ISO_DATE_FORMAT: str = '%Y-%m-%d'
+
+# Distinct non-ISO strings whose parse result is remembered across calls
+FALLBACK_CACHE_SIZE: int = 65536
+
+
+@lru_cache(maxsize=FALLBACK_CACHE_SIZE)
+def _parse_flexible(text: str) -> Optional[date]:
+    from dateutil import parser
+    try:
+        return parser.parse(text).date()
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def parse_date(value) -> Optional[date]:
+    """Parse one date-like value; None when it cannot be read as a date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    text = str(value).strip()
+    try:
+        return datetime.strptime(text, ISO_DATE_FORMAT).date()
+    except ValueError:
+        return _parse_flexible(text) if text else None
+
+
+def normalize_dates(values: Union[pd.Series, Iterable]) -> pd.Series:
+    """Convert strings, dates or timestamps to a datetime64 Series at midnight; NaT where unparseable.
+
+    Each distinct value is parsed once. The canonical YYYY-MM-DD format is
+    parsed as one array; only the values it rejects go through dateutil,
+    whose results are memoized across calls.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(values, pd.Series):
+        series = values
+    else:
+        # fromiter: pd.Series(list_of_dates) inspects every element and is far slower
+        items = list(values)
+        series = pd.Series(np.fromiter(items, dtype=object, count=len(items)))
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.normalize()
+
+    # Ledgers repeat the same few thousand days, so parse the distinct values only
+    codes, uniques = pd.factorize(series)
+    distinct = pd.Series(uniques, dtype=object)
+    parsed = pd.to_datetime(distinct, format=ISO_DATE_FORMAT, errors='coerce')
+    residual = parsed.isna()
+    if residual.any():
+        parsed.loc[residual] = pd.to_datetime(distinct[residual].map(parse_date), errors='coerce')
+
+    # Missing values have code -1, which picks the trailing NaT
+    lookup = np.append(parsed.dt.normalize().to_numpy(), np.datetime64('NaT', 'ns'))
+    return pd.Series(lookup[codes], index=series.index, name=series.name)
@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import json
+import statistics
+from datetime import date, timedelta
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+from flask import current_app
+from sqlalchemy import bindparam, func
+
+from models import db, CategoryStats, Transaction, current_ledger_id, transaction_fingerprint
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Robust z-score (0.6745 * deviation / MAD) from which a transaction counts as unusual (Iglewicz and Hoaglin)
+ANOMALY_THRESHOLD: float = 3.5
+ROBUST_Z_SCALE: float = 0.6745
+
+# Latest amounts per category that the rolling median and MAD are taken over
+ANOMALY_WINDOW: int = 250
+
+# Categories with fewer amounts in their window are not scored yet
+MIN_ANOMALY_HISTORY: int = 20
+
+# The MAD is floored at this share of the median (and at MIN_MAD), so a category of
+# near-identical amounts such as rent still needs a real deviation before it is flagged
+MIN_MAD_RATIO: float = 0.05
+MIN_MAD: float = 1.0
+
+# Flagged transactions older than this are left out of the insights
+ANOMALY_LOOKBACK_DAYS: int = 90
+
+# Flagged transactions listed in the insights
+ANOMALY_INSIGHT_LIMIT: int = 3
+
+# Fingerprints per IN (...) lookup, below SQLite's bound-parameter limit
+FINGERPRINT_LOOKUP_BATCH: int = 500
+
+# Rows fingerprinted per pass when backfilling rows from before fingerprints existed
+BACKFILL_CHUNK_SIZE: int = 50000
+
+
+def anomaly_scale(median: float, mad: float) -> float:
+    return max(mad, MIN_MAD_RATIO * abs(median), MIN_MAD)
+
+
+def _median_mad(window: List[float]) -> Tuple[Optional[float], Optional[float]]:
+    if len(window) < MIN_ANOMALY_HISTORY:
+        return None, None
+    median = statistics.median(window)
+    return median, statistics.median(abs(amount - median) for amount in window)
+
+
+def _score(stats: Optional[CategoryStats], amount: float) -> Optional[float]:
+    if stats is None or stats.median is None:
+        return None
+    return round(ROBUST_Z_SCALE * (amount - stats.median) / anomaly_scale(stats.median, stats.mad), 3)
+
+
+def load_category_stats() -> Dict[int, CategoryStats]:
+    return {stats.category: stats for stats in
+            CategoryStats.query.filter(CategoryStats.ledger_id == current_ledger_id())}
+
+
+def update_category_stats(stats: Dict[int, CategoryStats], categories: Iterable, amounts: Iterable) -> None:
+    # Appends amounts (oldest first) to each category's window and recomputes its median and MAD
+    added: Dict[int, List[float]] = {}
+    for category, amount in zip(categories, amounts):
+        added.setdefault(int(category), []).append(float(amount))
+    for category, new_amounts in added.items():
+        entry = stats.get(category)
+        if entry is None:
+            entry = stats[category] = CategoryStats(ledger_id=current_ledger_id(), category=category, amounts='[]')
+            db.session.add(entry)
+        window = (json.loads(entry.amounts) + new_amounts[-ANOMALY_WINDOW:])[-ANOMALY_WINDOW:]
+        entry.amounts = json.dumps(window)
+        entry.median, entry.mad = _median_mad(window)
+
+
+def existing_fingerprint_counts(fingerprints: Iterable[int], max_id: Optional[int] = None) -> Dict[int, int]:
+    """How often each fingerprint occurs in the active ledger (only ids up to ``max_id``, when given)."""
+    distinct = list(set(fingerprints))
+    counts: Dict[int, int] = {}
+    for start in range(0, len(distinct), FINGERPRINT_LOOKUP_BATCH):
+        query = db.session.query(Transaction.fingerprint, func.count()).filter(
+            Transaction.ledger_id == current_ledger_id(),
+            Transaction.fingerprint.in_(distinct[start:start + FINGERPRINT_LOOKUP_BATCH]))
+        if max_id is not None:
+            query = query.filter(Transaction.id <= max_id)
+        counts.update(query.group_by(Transaction.fingerprint).all())
+    return counts
+
+
+def screen_transaction(transaction: Transaction) -> bool:
+    """Fingerprint and score one new transaction before it is added; True if it duplicates a stored one.
+
+    Sets the transaction's fingerprint and anomaly_score and adds its amount
+    to the category's window. Duplicates are only reported, never dropped:
+    two identical entries typed in by hand are usually intended.
+    """
+    transaction.fingerprint = transaction_fingerprint(transaction.date, transaction.amount, transaction.description)
+    duplicate = bool(existing_fingerprint_counts([transaction.fingerprint]))
+    stats = {}
+    entry = db.session.get(CategoryStats, (current_ledger_id(), transaction.category))
+    if entry is not None:
+        stats[entry.category] = entry
+    transaction.anomaly_score = _score(entry, transaction.amount)
+    update_category_stats(stats, [transaction.category], [transaction.amount])
+    return duplicate
+
+
+class UploadScreen:
+    """The detection stage of one /upload, run on every validated chunk before it is inserted.
+
+    A row is a duplicate when its fingerprint matches a transaction that was in
+    the ledger before the upload started. Stored copies are matched one for
+    one, so a statement with two identical coffees imports both the first time
+    and neither when it is uploaded again. Duplicates are dropped with
+    ``skip_duplicates`` and only counted otherwise. Lookups go through the
+    (ledger_id, fingerprint) index and only see ids up to the maximum at the
+    start, so rows inserted by this upload are never matched.
+
+    The remaining rows are scored against their category's rolling median/MAD
+    as they stood before the chunk, then added to the windows.
+    """
+
+    def __init__(self, skip_duplicates: bool = True, threshold: float = ANOMALY_THRESHOLD):
+        self.skip_duplicates = skip_duplicates
+        self.threshold = threshold
+        self.duplicates = 0
+        self.anomalies = 0
+        self._max_id = db.session.query(func.coalesce(func.max(Transaction.id), 0)).scalar()
+        self._unmatched: Dict[int, int] = {}  # fingerprint -> stored copies not yet matched by an uploaded row
+        self._stats = load_category_stats()
+
+    def screen(self, clean: pd.DataFrame) -> pd.DataFrame:
+        """``clean`` from ingest.validate_frame, plus fingerprint and anomaly_score columns; duplicates removed if skipped."""
+        fingerprints = [transaction_fingerprint(day, amount, description) for day, amount, description
+                        in zip(clean['date'], clean['amount'], clean['description'])]
+        if self._max_id:  # nothing to match in a ledger that was empty when the upload started
+            unseen = [fingerprint for fingerprint in fingerprints if fingerprint not in self._unmatched]
+            self._unmatched.update(existing_fingerprint_counts(unseen, self._max_id))
+
+        duplicate = []
+        for fingerprint in fingerprints:
+            remaining = self._unmatched.get(fingerprint, 0)
+            if remaining:
+                self._unmatched[fingerprint] = remaining - 1
+            duplicate.append(remaining > 0)
+        self.duplicates += sum(duplicate)
+
+        clean = clean.assign(fingerprint=fingerprints)
+        if self.skip_duplicates and any(duplicate):
+            clean = clean[[not flag for flag in duplicate]]
+
+        medians = {category: stats.median for category, stats in self._stats.items() if stats.median is not None}
+        scales = {category: anomaly_scale(stats.median, stats.mad) for category, stats in self._stats.items()
+                  if stats.median is not None}
+        score = (ROBUST_Z_SCALE * (clean['amount'] - clean['category'].map(medians))
+                 / clean['category'].map(scales)).round(3)
+        self.anomalies += int((score >= self.threshold).sum())
+        clean = clean.assign(anomaly_score=score.astype(object).where(score.notna(), None))
+
+        update_category_stats(self._stats, clean['category'], clean['amount'])
+        return clean
+
+
+def recent_anomalies(threshold: float = ANOMALY_THRESHOLD, limit: int = ANOMALY_INSIGHT_LIMIT) -> List[Dict]:
+    """The latest flagged transactions of the active ledger, found through the (ledger_id, anomaly_score) index."""
+    since = date.today() - timedelta(days=ANOMALY_LOOKBACK_DAYS)
+    flagged = Transaction.query.filter(Transaction.ledger_id == current_ledger_id(),
+                                       Transaction.anomaly_score >= threshold,
+                                       Transaction.date >= since
+                                       ).order_by(Transaction.date.desc(), Transaction.id.desc()).limit(limit).all()
+    stats = load_category_stats() if flagged else {}
+    return [{
+        'id': transaction.id,
+        'date': transaction.date.isoformat(),
+        'amount': transaction.amount,
+        'category': transaction.category,
+        'description': transaction.description or '',
+        'score': transaction.anomaly_score,
+        'usual': stats[transaction.category].median if transaction.category in stats else None,
+    } for transaction in flagged]
+
+
+def clear_category_stats() -> None:
+    CategoryStats.query.filter(CategoryStats.ledger_id == current_ledger_id()).delete()
+
+
+def _backfill_fingerprints() -> None:
+    ledger_id = current_ledger_id()
+    missing = db.session.query(Transaction.id).filter(Transaction.ledger_id == ledger_id,
+                                                      Transaction.fingerprint.is_(None))
+    if missing.first() is None:
+        return
+    filled = 0
+    while True:
+        rows = db.session.query(Transaction.id, Transaction.date, Transaction.amount, Transaction.description).filter(
+            Transaction.ledger_id == ledger_id, Transaction.fingerprint.is_(None)).limit(BACKFILL_CHUNK_SIZE).all()
+        if not rows:
+            break
+        db.session.execute(Transaction.__table__.update().where(Transaction.id == bindparam('row_id')).values(
+            fingerprint=bindparam('row_fingerprint')),
+            [{'row_id': row.id, 'row_fingerprint': transaction_fingerprint(row.date, row.amount, row.description)}
+             for row in rows])
+        db.session.commit()
+        filled += len(rows)
+    current_app.logger.info("Fingerprinted %d transactions of ledger %d", filled, ledger_id)
+
+
+def _rebuild_category_stats() -> None:
+    # Each window is refilled from the category's latest rows through the (ledger_id, category, date) index
+    ledger_id = current_ledger_id()
+    stats: Dict[int, CategoryStats] = {}
+    categories = [category for (category,) in db.session.query(Transaction.category).filter(
+        Transaction.ledger_id == ledger_id).distinct()]
+    for category in categories:
+        latest = db.session.query(Transaction.amount).filter(
+            Transaction.ledger_id == ledger_id, Transaction.category == category
+        ).order_by(Transaction.date.desc(), Transaction.id.desc()).limit(ANOMALY_WINDOW).all()
+        update_category_stats(stats, [category] * len(latest), [amount for (amount,) in reversed(latest)])
+    db.session.commit()
+
+
+def ensure_detection() -> None:
+    # Databases from before duplicate and anomaly detection: fingerprint old rows and seed the windows once
+    _backfill_fingerprints()
+    if CategoryStats.query.filter(CategoryStats.ledger_id == current_ledger_id()).first() is None:
+        _rebuild_category_stats()
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import csv
+import importlib.util
+import io
+from typing import Dict, Iterable, Iterator, List
+
+from categories import CATEGORIES
+from models import db, Transaction
+from profiling import profiler
+
+# format -> mimetype for /export
+EXPORT_FORMATS: Dict[str, str] = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# amount, category, date and description match the /upload format, so an export can be imported again
+EXPORT_COLUMNS: List[str] = ['id', 'date', 'amount', 'category', 'category_name', 'description', 'anomaly_score']
+
+# Rows fetched from the cursor, written and sent per chunk (one Parquet row group each)
+EXPORT_CHUNK_SIZE: int = 10000
+
+# pyarrow is optional: without it only CSV can be exported
+PARQUET_INSTALLED: bool = importlib.util.find_spec('pyarrow') is not None
+
+
+def export_rows(query) -> Iterator[List]:
+    """Stream ``query`` (filtered transactions) oldest first, in lists of up to EXPORT_CHUNK_SIZE rows.
+
+    yield_per makes SQLAlchemy stream the result (a server-side cursor where
+    the driver has one; SQLite steps its cursor as rows are fetched), so only
+    one chunk is held in memory however many rows are exported.
+    """
+    statement = query.with_entities(
+        Transaction.id, Transaction.date, Transaction.amount, Transaction.category,
+        Transaction.description, Transaction.anomaly_score
+    ).order_by(Transaction.date, Transaction.id).statement
+    # On the session's connection (same transaction and ledger database), skipping the ORM's row loading
+    connection = db.session.connection(bind_arguments={'mapper': Transaction})
+    yield from connection.execution_options(yield_per=EXPORT_CHUNK_SIZE).execute(statement).partitions()
+
+
+def csv_chunks(chunks: Iterable[List]) -> Iterator[bytes]:
+    # The header goes out before the first row is fetched
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode('utf-8')
+    for chunk in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        with profiler.span('export:csv', rows=len(chunk)):
+            writer.writerows((row_id, day.isoformat(), amount, category, CATEGORIES.get(category, 'Unknown'),
+                              description or '', '' if score is None else score)
+                             for row_id, day, amount, category, description, score in chunk)
+        yield buffer.getvalue().encode('utf-8')
+
+
+class _ByteSink(io.RawIOBase):
+    # A write-only file for pyarrow's ParquetWriter whose output is taken away chunk by chunk
+    def __init__(self):
+        super().__init__()
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_chunks(chunks: Iterable[List]) -> Iterator[bytes]:
+    """Write each chunk as one Parquet row group and pass the bytes on as soon as they are written."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('date', pa.date32()),
+        ('amount', pa.float64()),
+        ('category', pa.int32()),
+        ('category_name', pa.string()),
+        ('description', pa.string()),
+        ('anomaly_score', pa.float64()),
+    ])
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for chunk in chunks:
+            with profiler.span('export:parquet', rows=len(chunk)):
+                ids, days, amounts, categories, descriptions, scores = zip(*chunk)
+                writer.write_table(pa.table({
+                    'id': ids,
+                    'date': days,
+                    'amount': amounts,
+                    'category': categories,
+                    'category_name': [CATEGORIES.get(category, 'Unknown') for category in categories],
+                    'description': [description or '' for description in descriptions],
+                    'anomaly_score': scores,
+                }, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()  # the footer; an empty export is still a valid file with the schema
+    yield sink.drain()
@@ -1,99 +1,151 @@
 import pandas as pd
-from datetime import datetime, date
-from dateutil.parser import parse
-from typing import List, Dict, Optional
-from sklearn.cluster import KMeans
-from sklearn.tree import DecisionTreeClassifier
+from datetime import datetime
+from typing import List, Dict, Optional, Union
+from sklearn.cluster import MiniBatchKMeans
 import numpy as np
 
-# Define constants for category mapping
-CATEGORIES: Dict[int, str] = {
-    1: "Groceries",
-    2: "Entertainment",
-    3: "Household",
-    4: "Transportation",
-    6: "Education",
-    7: "Utilities",
-    8: "Others"
-}
+from categories import CATEGORIES
+from detection import (ANOMALY_INSIGHT_LIMIT, ANOMALY_LOOKBACK_DAYS, ANOMALY_THRESHOLD, MIN_ANOMALY_HISTORY,
+                       MIN_MAD, MIN_MAD_RATIO, ROBUST_Z_SCALE)
+from forecasting import ForecastEngine, transaction_series
+from transaction_batch import TransactionBatch
+from profiling import profiler
 
 # Define threshold for high spending category analysis
 HIGH_SPENDING_THRESHOLD: float = 0.3
 
+# Number of spending clusters reported by the KMeans insight
+N_SPENDING_CLUSTERS: int = 3
+
+# A weekly forecast within this share of last week's spend (and at least MIN_TREND_CHANGE) counts as no change
+TREND_TOLERANCE: float = 0.02
+MIN_TREND_CHANGE: float = 1.0
+
+
+def new_kmeans_model() -> MiniBatchKMeans:
+    # MiniBatchKMeans so a persisted model can be updated with partial_fit on new rows
+    return MiniBatchKMeans(n_clusters=N_SPENDING_CLUSTERS, random_state=42, n_init=3)
+
+
+def fit_kmeans_model(transaction_df: pd.DataFrame) -> MiniBatchKMeans:
+    kmeans = new_kmeans_model()
+    with profiler.span('model:kmeans_fit', rows=len(transaction_df)):
+        kmeans.fit(transaction_df[['amount', 'category']])
+    return kmeans
+
+
 class FinanceAdvisor:
-    def __init__(self, transactions: List):
+    def __init__(self, transactions: Union[TransactionBatch, pd.DataFrame, List], aggregates: Optional[Dict[str, pd.DataFrame]] = None,
+                 kmeans_model: Optional[MiniBatchKMeans] = None,
+                 forecasts: Optional[Dict[str, List[Dict]]] = None,
+                 anomalies: Optional[List[Dict]] = None,
+                 inference_only: bool = False):
+        # A TransactionBatch, a DataFrame (e.g. Snapshot.frame()) or a list of Transaction-like objects or dicts
         self.transactions = transactions
-        self.transaction_df = self._prepare_transaction_data()
+        # Optional precomputed 'week'/'month'/'category' rollups (see aggregates.load_rollups);
+        # when present the spending summaries read them instead of scanning transaction_df
+        self.aggregates = aggregates
+        with profiler.span('advisor:prepare_transaction_data', rows=len(transactions)):
+            self.transaction_df = self._prepare_transaction_data()
         self.current_week_number: int = datetime.now().isocalendar()[1]
         self.current_year: int = datetime.now().year
 
-        # KMeans and Decision Tree Models
-        self.kmeans_model = None
-        self.decision_tree_model = None
+        # KMeans model, spend forecasts and unusual transactions: precomputed ones (from
+        # model_registry, forecasting.ForecastEngine and detection.recent_anomalies) are used
+        # as-is; otherwise they are computed from transaction_df unless inference_only is set
+        self.kmeans_model = kmeans_model
+        self.forecasts = forecasts
+        self.anomalies = anomalies
+        self.inference_only = inference_only
 
     def _prepare_transaction_data(self) -> pd.DataFrame:
-        prepared_data: List[Dict] = []
-        for transaction in self.transactions:
-            try:
-                transaction_date: Optional[date] = None
-                if isinstance(transaction.date, str):
-                    transaction_date = parse(transaction.date).date()
-                elif isinstance(transaction.date, date):
-                    transaction_date = transaction.date
-
-                if transaction_date:
-                    prepared_data.append({
-                        'amount': float(transaction.amount),
-                        'category': int(transaction.category),
-                        'date': transaction_date,
-                        'description': str(transaction.description) if transaction.description else ''
-                    })
-            except (ValueError, TypeError, AttributeError) as e:
-                print(f"Warning: Skipping invalid transaction data - {e}")
-
-        if not prepared_data:
-            return pd.DataFrame(columns=['amount', 'category', 'date', 'description'])
-
-        df = pd.DataFrame(prepared_data)
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df.dropna(subset=['date'], inplace=True)
+        # Every input becomes a TransactionBatch, so the frame is built from column arrays
+        transactions = self.transactions
+        if isinstance(transactions, pd.DataFrame):
+            transactions = TransactionBatch.from_frame(transactions)
+        elif not isinstance(transactions, TransactionBatch):
+            transactions = TransactionBatch.from_records(transactions)
+
+        df = transactions.to_frame()
+        invalid_dates = int(df['date'].isna().sum())
+        if invalid_dates:
+            print(f"Warning: Skipping {invalid_dates} transactions with invalid dates")
+            df = df.dropna(subset=['date'])
+        return self._add_derived_columns(df)
+
+    @staticmethod
+    def _add_derived_columns(df: pd.DataFrame) -> pd.DataFrame:
         df['week'] = df['date'].dt.isocalendar().week
         df['month'] = df['date'].dt.month
         df['category_name'] = df['category'].map(CATEGORIES)
         return df
 
+    def _transaction_count(self) -> int:
+        if self.aggregates is not None:
+            return int(self.aggregates['category']['count'].sum())
+        return len(self.transaction_df)
+
+    def _weekly_totals(self) -> pd.Series:
+        # Spending per ISO week of the current year
+        if self.aggregates is not None:
+            weekly = self.aggregates['week']
+            return weekly[weekly['year'] == self.current_year].groupby('week')['total'].sum()
+        return self.transaction_df[self.transaction_df['date'].dt.year == self.current_year].groupby('week')['amount'].sum()
+
+    def _category_totals(self) -> pd.Series:
+        # Spending per known category name
+        if self.aggregates is not None:
+            by_category = self.aggregates['category']
+            return by_category.groupby(by_category['category'].map(CATEGORIES))['total'].sum()
+        return self.transaction_df.groupby('category_name')['amount'].sum()
+
+    def _total_spending(self) -> float:
+        if self.aggregates is not None:
+            return float(self.aggregates['category']['total'].sum())
+        return float(self.transaction_df['amount'].sum())
+
     def generate_insights(self) -> List[str]:
-        if len(self.transaction_df) < 10:
+        if self._transaction_count() < 10:
             return ["Insufficient transaction data for detailed insights. Please add at least 10 transactions."]
 
         insights: List[str] = []
 
-        weekly_comparison_insight: Optional[str] = self._analyze_weekly_spending()
+        with profiler.span('advisor:weekly_spending'):
+            weekly_comparison_insight: Optional[str] = self._analyze_weekly_spending()
         if weekly_comparison_insight:
             insights.append(weekly_comparison_insight)
 
-        category_analysis_insight: Optional[str] = self._analyze_spending_by_category()
+        with profiler.span('advisor:spending_by_category'):
+            category_analysis_insight: Optional[str] = self._analyze_spending_by_category()
         if category_analysis_insight:
             insights.append(category_analysis_insight)
 
         # KMeans clustering analysis
-        kmeans_insight: Optional[str] = self._perform_kmeans_clustering()
+        with profiler.span('advisor:kmeans_clustering'):
+            kmeans_insight: Optional[str] = self._perform_kmeans_clustering()
         if kmeans_insight:
             insights.append(kmeans_insight)
 
-        # Decision Tree prediction
-        decision_tree_insight: Optional[str] = self._predict_spending_trend()
-        if decision_tree_insight:
-            insights.append(decision_tree_insight)
+        # Next-period spend forecast
+        with profiler.span('advisor:spending_trend'):
+            forecast_insight: Optional[str] = self._predict_spending_trend()
+        if forecast_insight:
+            insights.append(forecast_insight)
 
-        budget_recommendations: List[str] = self._generate_budget_recommendations()
+        with profiler.span('advisor:anomalies'):
+            anomaly_insight: Optional[str] = self._report_anomalies()
+        if anomaly_insight:
+            insights.append(anomaly_insight)
+
+        with profiler.span('advisor:budget_recommendations'):
+            budget_recommendations: List[str] = self._generate_budget_recommendations()
         insights.extend(budget_recommendations[:2])
 
         return insights
 
     def _analyze_weekly_spending(self) -> Optional[str]:
         try:
-            weekly_spending = self.transaction_df[self.transaction_df['date'].dt.year == self.current_year].groupby('week')['amount'].sum()
+            weekly_spending = self._weekly_totals()
 
             if len(weekly_spending) < 2:
                 return None
@@ -118,7 +170,7 @@ class FinanceAdvisor:
 
     def _analyze_spending_by_category(self) -> Optional[str]:
         try:
-            category_spending = self.transaction_df.groupby('category_name')['amount'].sum()
+            category_spending = self._category_totals()
             if category_spending.empty:
                 return None
 
@@ -137,14 +189,13 @@ class FinanceAdvisor:
 
     def _perform_kmeans_clustering(self) -> Optional[str]:
         try:
-            # Prepare data for clustering
-            clustering_data = self.transaction_df[['amount', 'category']]
-            kmeans = KMeans(n_clusters=3, random_state=42)
-            clustering_data['cluster'] = kmeans.fit_predict(clustering_data)
+            if self.kmeans_model is None:
+                if self.inference_only:
+                    return None
+                self.kmeans_model = fit_kmeans_model(self.transaction_df)
 
             # Get insights based on clusters
-            cluster_centers = kmeans.cluster_centers_
-            cluster_labels = ["Cluster 1", "Cluster 2", "Cluster 3"]
+            cluster_centers = self.kmeans_model.cluster_centers_
             insights = []
             for i, center in enumerate(cluster_centers):
                 insights.append(f"🔍 Cluster {i+1}: Average spending = ₹{center[0]:,.2f}, Category = {CATEGORIES.get(int(center[1]), 'Unknown')}")
@@ -155,37 +206,97 @@ class FinanceAdvisor:
 
     def _predict_spending_trend(self) -> Optional[str]:
         try:
-            # Prepare data for decision tree
-            self.transaction_df['week'] = self.transaction_df['date'].dt.isocalendar().week
-            self.transaction_df['week_diff'] = self.transaction_df['week'].diff().fillna(0)
-
-            X = self.transaction_df[['week_diff', 'amount']]
-            y = (self.transaction_df['amount'].shift(-1) > self.transaction_df['amount']).astype(int)
+            if self.forecasts is None:
+                if self.inference_only:
+                    return None
+                engine = ForecastEngine(backend='smoothing', processes=1)
+                self.forecasts = {}
+                for grain in ('week', 'month'):
+                    totals = transaction_series(self.transaction_df, grain).get(None)
+                    self.forecasts[grain] = engine.forecast({None: totals}, grain, 1) if totals is not None else []
+
+            # Forecasts of total spending (category None) for the current week and month
+            totals = {grain: next((entry for entry in entries if entry['category'] is None and entry['forecast']), None)
+                      for grain, entries in self.forecasts.items()}
+            weekly = totals.get('week')
+            if weekly is None:
+                return None
 
-            # Train decision tree
-            decision_tree = DecisionTreeClassifier(random_state=42)
-            decision_tree.fit(X, y)
+            this_week = weekly['forecast'][0]
+            change = this_week['yhat'] - weekly['last_actual']
+            if abs(change) <= max(TREND_TOLERANCE * abs(weekly['last_actual']), MIN_TREND_CHANGE):
+                trend = "stay about the same"
+            else:
+                trend = "increase" if change > 0 else "decrease"
+            insight_lines: List[str] = [
+                f"📈 Your expenses are expected to {trend} this week: about ₹{this_week['yhat']:,.2f} "
+                f"(likely between ₹{this_week['lower']:,.2f} and ₹{this_week['upper']:,.2f}) "
+                f"against ₹{weekly['last_actual']:,.2f} last week."
+            ]
+            monthly = totals.get('month')
+            if monthly is not None:
+                this_month = monthly['forecast'][0]
+                insight_lines.append(f"🗓️ Forecast for this month: ₹{this_month['yhat']:,.2f} "
+                                     f"(₹{this_month['lower']:,.2f} – ₹{this_month['upper']:,.2f}).")
+            return "\n".join(insight_lines)
+        except Exception as e:
+            print(f"Error predicting spending trend: {e}")
+            return None
 
-            # Predict next week's trend
-            prediction = decision_tree.predict([[1, 100]])  # Dummy input, should be real-time data
-            trend = "increase" if prediction[0] == 1 else "decrease"
+    def _find_anomalies(self) -> List[Dict]:
+        # Same robust z-score as detection.py, against each category's median/MAD over the whole frame
+        df = self.transaction_df
+        amounts = df.groupby('category')['amount']
+        median = amounts.transform('median')
+        mad = (df['amount'] - median).abs().groupby(df['category']).transform('median')
+        scale = np.maximum(mad, np.maximum(MIN_MAD_RATIO * median.abs(), MIN_MAD))
+        score = ROBUST_Z_SCALE * (df['amount'] - median) / scale
+        recent = df['date'] >= df['date'].max() - pd.Timedelta(days=ANOMALY_LOOKBACK_DAYS)
+        flagged = df[(score >= ANOMALY_THRESHOLD) & (amounts.transform('size') >= MIN_ANOMALY_HISTORY) & recent]
+        flagged = flagged.sort_values('date', ascending=False).head(ANOMALY_INSIGHT_LIMIT)
+        return [{
+            'date': row.date.date().isoformat(),
+            'amount': float(row.amount),
+            'category': int(row.category),
+            'description': str(row.description),
+            'score': round(float(score[index]), 3),
+            'usual': float(median[index]),
+        } for index, row in zip(flagged.index, flagged.itertuples())]
+
+    def _report_anomalies(self) -> Optional[str]:
+        try:
+            if self.anomalies is None:
+                if self.inference_only:
+                    return None
+                self.anomalies = self._find_anomalies()
+            if not self.anomalies:
+                return None
 
-            return f"📉 Based on the decision tree model, your expenses are expected to {trend} next week."
+            insight_lines: List[str] = ["🚨 Unusual transactions for their category:"]
+            for anomaly in self.anomalies:
+                description = f" ({anomaly['description']})" if anomaly['description'] else ""
+                line = (f"• ₹{anomaly['amount']:,.2f} on {anomaly['date']}{description} in "
+                        f"{CATEGORIES.get(anomaly['category'], 'Unknown')}")
+                if anomaly.get('usual'):
+                    line += f", where ₹{anomaly['usual']:,.2f} is typical"
+                insight_lines.append(line)
+            insight_lines.append("🧐 Check these are expected, and not a mistake or an unauthorised charge.")
+            return "\n".join(insight_lines)
         except Exception as e:
-            print(f"Error predicting spending trend: {e}")
+            print(f"Error reporting unusual transactions: {e}")
             return None
 
     def _generate_budget_recommendations(self) -> List[str]:
         recommendations: List[str] = []
 
         try:
-            category_spending_ratio = self.transaction_df.groupby('category_name')['amount'].sum() / self.transaction_df['amount'].sum()
+            category_spending_ratio = self._category_totals() / self._total_spending()
             high_spending_categories = category_spending_ratio[category_spending_ratio > HIGH_SPENDING_THRESHOLD]
 
             for category, ratio in high_spending_categories.items():
                 recommendations.append(f"🔎 Spending on '{category}' is consuming {ratio:.0%} of your total expenses. Set a monthly cap or explore alternatives to reduce recurring cost.")
 
-            weekly_spending = self.transaction_df[self.transaction_df['date'].dt.year == self.current_year].groupby('week')['amount'].sum()
+            weekly_spending = self._weekly_totals()
 
             if len(weekly_spending) >= 4:
                 average_weekly_spending: float = weekly_spending.mean()
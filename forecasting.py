@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import logging
+import threading
+import time
+from datetime import date
+from statistics import NormalDist
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from process_pool import DEFAULT_POOL_PROCESSES, get_process_pool
+from profiling import profiler
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Prophet is optional (the exponential-smoothing model below is used instead). Importing it
+# pulls in cmdstanpy, so only check that it is installed; ProphetModel.fit imports it
+PROPHET_INSTALLED: bool = importlib.util.find_spec('prophet') is not None
+
+# Pandas period frequency per forecast grain; W-SUN periods are Monday-Sunday ISO weeks
+FORECAST_GRAINS: Dict[str, str] = {'week': 'W-SUN', 'month': 'M'}
+
+# Periods forecast by the 'forecasts' job and the upper bound accepted by /api/forecasts
+DEFAULT_HORIZONS: Dict[str, int] = {'week': 4, 'month': 3}
+MAX_HORIZONS: Dict[str, int] = {'week': 52, 'month': 24}
+
+# Coverage of the prediction intervals (Prophet's default)
+INTERVAL_WIDTH: float = 0.8
+
+# Shorter histories get no forecast
+MIN_HISTORY_PERIODS: int = 3
+
+# Prophet models yearly seasonality only with at least two years of history
+PERIODS_PER_YEAR: Dict[str, int] = {'week': 52, 'month': 12}
+
+DEFAULT_BACKEND: str = 'prophet' if PROPHET_INSTALLED else 'smoothing'
+
+# Worker processes for Prophet fits; the smoothing model is cheap enough to fit inline
+DEFAULT_FORECAST_PROCESSES: int = DEFAULT_POOL_PROCESSES
+
+# ModelRegistry entry holding every fitted forecast model
+FORECAST_MODEL_NAME = 'forecasts'
+
+
+class SmoothingModel:
+    """Damped-trend exponential smoothing (Holt) with normal prediction intervals.
+
+    The smoothing parameters are picked by a grid search on the one-step-ahead
+    squared error. The whole grid is evaluated in one pass over the series.
+    """
+    backend = 'smoothing'
+    ALPHAS = tuple(round(0.05 * step, 2) for step in range(1, 20))  # 0.05 to 0.95
+    BETAS = (0.0, 0.05, 0.1, 0.2, 0.3)
+    PHI = 0.9
+
+    def fit(self, series: pd.Series) -> 'SmoothingModel':
+        import numpy as np
+        values = series.to_numpy(dtype=float)
+        alpha, beta = (grid.ravel() for grid in np.meshgrid(self.ALPHAS, self.BETAS))
+        level = np.full(alpha.shape, values[0])
+        trend = np.zeros(alpha.shape)
+        sse = np.zeros(alpha.shape)
+        for value in values[1:]:
+            error = value - (level + self.PHI * trend)
+            sse += error ** 2
+            level = level + self.PHI * trend + alpha * error
+            trend = self.PHI * trend + alpha * beta * error
+
+        best = int(np.argmin(sse))
+        self.alpha = float(alpha[best])
+        self.beta = float(beta[best])
+        self.level = float(level[best])
+        self.trend = float(trend[best])
+        self.sigma = float(np.sqrt(sse[best] / max(len(values) - 3, 1)))
+        self.last_period = series.index[-1]
+        return self
+
+    def predict(self, steps: int) -> Tuple[pd.PeriodIndex, np.ndarray, np.ndarray, np.ndarray]:
+        import numpy as np
+        import pandas as pd
+        damping = np.cumsum(self.PHI ** np.arange(1, steps + 1))
+        mean = self.level + damping * self.trend
+        # Forecast variance of the additive damped-trend model grows with the horizon
+        growth = (self.alpha + self.alpha * self.beta * damping[:-1]) ** 2
+        variance = self.sigma ** 2 * (1 + np.concatenate([[0.0], np.cumsum(growth)]))
+        spread = NormalDist().inv_cdf(0.5 + INTERVAL_WIDTH / 2) * np.sqrt(variance)
+        periods = pd.period_range(self.last_period + 1, periods=steps, freq=self.last_period.freq)
+        return periods, np.maximum(mean, 0), np.maximum(mean - spread, 0), np.maximum(mean + spread, 0)
+
+
+class ProphetModel:
+    backend = 'prophet'
+
+    def fit(self, series: pd.Series) -> 'ProphetModel':
+        import pandas as pd
+        from prophet import Prophet
+        grain = next(name for name, freq in FORECAST_GRAINS.items() if series.index.freqstr == freq)
+        self.model = Prophet(interval_width=INTERVAL_WIDTH,
+                             yearly_seasonality=len(series) >= 2 * PERIODS_PER_YEAR[grain],
+                             weekly_seasonality=False, daily_seasonality=False)
+        self.model.fit(pd.DataFrame({'ds': series.index.to_timestamp(), 'y': series.to_numpy(dtype=float)}))
+        self.last_period = series.index[-1]
+        return self
+
+    def predict(self, steps: int) -> Tuple[pd.PeriodIndex, np.ndarray, np.ndarray, np.ndarray]:
+        import numpy as np
+        import pandas as pd
+        periods = pd.period_range(self.last_period + 1, periods=steps, freq=self.last_period.freq)
+        forecast = self.model.predict(pd.DataFrame({'ds': periods.to_timestamp()}))
+        return (periods, np.maximum(forecast['yhat'].to_numpy(), 0),
+                np.maximum(forecast['yhat_lower'].to_numpy(), 0), np.maximum(forecast['yhat_upper'].to_numpy(), 0))
+
+
+def _fit_model(backend: str, series: pd.Series):
+    if backend == 'prophet':
+        # cmdstanpy logs every fit at INFO
+        logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+        return ProphetModel().fit(series)
+    return SmoothingModel().fit(series)
+
+
+def _complete_series(frame: pd.DataFrame, grain: str, today: Optional[date] = None) -> Dict[Optional[int], pd.Series]:
+    # frame: period, category, amount. History runs from the first period with spending
+    # to the last complete one; periods without spending count as zero
+    import pandas as pd
+    freq = FORECAST_GRAINS[grain]
+    current = pd.Period(today or date.today(), freq=freq)
+    frame = frame[frame['period'] < current]
+    if frame.empty:
+        return {}
+    index = pd.period_range(frame['period'].min(), current - 1, freq=freq)
+    table = frame.pivot_table(index='period', columns='category', values='amount', aggfunc='sum')
+    table = table.reindex(index).fillna(0.0)
+    series: Dict[Optional[int], pd.Series] = {None: table.sum(axis=1)}  # None: all categories
+    for category in table.columns:
+        series[int(category)] = table[category]
+    return series
+
+
+def rollup_series(rollups: Dict[str, pd.DataFrame], grain: str) -> Dict[Optional[int], pd.Series]:
+    """Per-category spend per period from aggregates.load_rollups, plus the total under key None."""
+    import pandas as pd
+    rollup = rollups[grain]
+    if rollup.empty:
+        return {}
+    if grain == 'week':
+        starts = pd.to_datetime(rollup['year'].astype(str) + '-' + rollup['week'].astype(str) + '-1',
+                                format='%G-%V-%u')
+    else:
+        starts = pd.to_datetime(pd.DataFrame({'year': rollup['year'], 'month': rollup['month'], 'day': 1}))
+    frame = pd.DataFrame({'period': starts.dt.to_period(FORECAST_GRAINS[grain]),
+                          'category': rollup['category'], 'amount': rollup['total']})
+    return _complete_series(frame, grain)
+
+
+def transaction_series(transaction_df: pd.DataFrame, grain: str) -> Dict[Optional[int], pd.Series]:
+    """Same as rollup_series, from a FinanceAdvisor transaction_df."""
+    import pandas as pd
+    if transaction_df.empty:
+        return {}
+    frame = pd.DataFrame({'period': transaction_df['date'].dt.to_period(FORECAST_GRAINS[grain]),
+                          'category': transaction_df['category'], 'amount': transaction_df['amount']})
+    return _complete_series(frame, grain)
+
+
+def _period_label(period: pd.Period, grain: str) -> str:
+    # Same bucket labels as the spending_aggregates table
+    if grain == 'week':
+        year, week, _ = period.start_time.isocalendar()
+        return f"{year}-W{week:02d}"
+    return period.strftime('%Y-%m')
+
+
+def _series_digest(backend: str, series: pd.Series) -> str:
+    digest = hashlib.md5(f"{backend}:{series.index[0]}:{len(series)}".encode())
+    digest.update(series.to_numpy(dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+class ForecastEngine:
+    """Per-category spend forecasts with prediction intervals.
+
+    Each series gets its own model: Prophet when it is installed, otherwise
+    ``SmoothingModel``. Fitted models are cached per (grain, category) with a
+    digest of the series they were fitted on, and persisted through ``store``
+    (a ModelRegistry) when one is given. Only series whose history changed
+    are refitted. Prophet fits run across ``processes`` worker processes.
+    """
+
+    def __init__(self, store=None, backend: str = DEFAULT_BACKEND,
+                 processes: int = DEFAULT_FORECAST_PROCESSES):
+        if backend == 'prophet' and not PROPHET_INSTALLED:
+            print("Warning: prophet is not installed, forecasting with exponential smoothing")
+            backend = 'smoothing'
+        self.store = store
+        self.backend = backend
+        self.processes = processes
+        self._models: Dict[Tuple[str, Optional[int]], Tuple[str, object]] = {}
+        self._lock = threading.Lock()
+
+    def _cached_models(self) -> Dict[Tuple[str, Optional[int]], Tuple[str, object]]:
+        # Re-read from the store so models fitted by another worker process are reused
+        if self.store is not None:
+            entry = self.store.load(FORECAST_MODEL_NAME)
+            if entry is not None:
+                return dict(entry[0])
+        return dict(self._models)
+
+    def _fit_all(self, stale: Dict[Optional[int], pd.Series]) -> Dict[Optional[int], object]:
+        if self.backend == 'prophet' and self.processes > 1 and len(stale) > 1:
+            executor = get_process_pool(self.processes)
+            futures = {category: executor.submit(_fit_model, self.backend, series)
+                       for category, series in stale.items()}
+            return {category: future.result() for category, future in futures.items()}
+        return {category: _fit_model(self.backend, series) for category, series in stale.items()}
+
+    def fitted_models(self, series_by_category: Dict[Optional[int], pd.Series], grain: str) -> Dict[Optional[int], object]:
+        with self._lock:
+            models = self._cached_models()
+            digests = {}
+            stale = {}
+            for category, series in series_by_category.items():
+                if len(series) < MIN_HISTORY_PERIODS:
+                    continue
+                digests[category] = _series_digest(self.backend, series)
+                cached = models.get((grain, category))
+                if cached is None or cached[0] != digests[category]:
+                    stale[category] = series
+
+            if stale:
+                with profiler.span(f'forecast:fit_{grain}', rows=len(stale)):
+                    fitted = self._fit_all(stale)
+                for category, model in fitted.items():
+                    models[(grain, category)] = (digests[category], model)
+                self._models = models
+                if self.store is not None:
+                    self.store.save(FORECAST_MODEL_NAME, models, {'backend': self.backend, 'saved_at': time.time()})
+            return {category: models[(grain, category)][1] for category in digests}
+
+    def forecast(self, series_by_category: Dict[Optional[int], pd.Series], grain: str, horizon: int) -> List[Dict]:
+        """Forecast ``horizon`` periods after the last complete one for every series.
+
+        Returns one entry per series (category None is the total). Each entry
+        has the last actual value and a list of {period, start, yhat, lower,
+        upper} points. The list is empty when the history is too short.
+        """
+        models = self.fitted_models(series_by_category, grain)
+        forecasts: List[Dict] = []
+        with profiler.span(f'forecast:predict_{grain}', rows=len(models)):
+            for category, series in series_by_category.items():
+                entry = {
+                    'category': category,
+                    'history_periods': len(series),
+                    'last_period': _period_label(series.index[-1], grain),
+                    'last_actual': round(float(series.iloc[-1]), 2),
+                    'backend': None,
+                    'forecast': [],
+                }
+                model = models.get(category)
+                if model is not None:
+                    periods, mean, lower, upper = model.predict(horizon)
+                    entry['backend'] = model.backend
+                    entry['forecast'] = [{
+                        'period': _period_label(period, grain),
+                        'start': period.start_time.date().isoformat(),
+                        'yhat': round(float(yhat), 2),
+                        'lower': round(float(low), 2),
+                        'upper': round(float(high), 2),
+                    } for period, yhat, low, high in zip(periods, mean, lower, upper)]
+                forecasts.append(entry)
+        return forecasts
@@ -0,0 +1,35 @@
+# Production serving: pip install gunicorn, then run `gunicorn -c gunicorn.conf.py`
+# Every setting can be overridden on the command line or through the GUNICORN_* variables below.
+import os
+
+wsgi_app = 'app:create_app()'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Worker processes; each has its own connection pool (DB_POOL_SIZE) and job worker thread
+workers = int(os.environ.get('GUNICORN_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Threads per worker. Requests mostly wait on SQLite or numpy, which release the GIL, and WAL
+# lets those reads run while another thread commits an upload. Keep DB_POOL_SIZE at least this large.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Create or migrate the database once in the master instead of racing in every worker;
+# create_app disposes of its connections before the fork
+preload_app = True
+
+
+def on_starting(server):
+    # Runs in the master after the preloaded app is built: import pandas, matplotlib and
+    # scikit-learn once here so the forked workers share them (the app imports them lazily)
+    if os.environ.get('GUNICORN_PRELOAD_MODULES', '1') == '1':
+        from app import preload_modules
+        preload_modules(server.app.wsgi())
+
+
+# Large CSV uploads are processed inside the request
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import io
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterator, List, Tuple
+
+from dates import normalize_dates
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Columns every uploaded CSV has to provide
+REQUIRED_COLUMNS: List[str] = ['amount', 'category', 'date']
+
+# Default number of rows written per executemany batch
+DEFAULT_BATCH_SIZE: int = 5000
+
+# Default number of CSV rows parsed, validated and committed together
+DEFAULT_CHUNK_SIZE: int = 50000
+
+
+def validate_frame(df: pd.DataFrame, row_offset: int = 0) -> Tuple[pd.DataFrame, List[str]]:
+    """Validate a raw CSV frame column-wise.
+
+    Returns the accepted rows coerced to the ``transactions`` column types and
+    a list of per-row error messages. Row numbers match the line numbers of
+    the uploaded file (header is line 1), shifted by ``row_offset``.
+    """
+    import pandas as pd
+
+    row_numbers = pd.RangeIndex(len(df)) + row_offset + 2
+
+    raw_amounts = df['amount']
+    amounts = pd.to_numeric(raw_amounts, errors='coerce')
+    bad_amount = amounts.isna().to_numpy()
+
+    raw_categories = df['category']
+    categories = pd.to_numeric(raw_categories, errors='coerce')
+    bad_category = (categories.isna() | (categories % 1 != 0)).to_numpy() & ~bad_amount
+
+    raw_dates = df['date']
+    dates = normalize_dates(raw_dates)
+    bad_date = dates.isna().to_numpy() & ~bad_amount & ~bad_category
+
+    error_rows: List[Tuple[int, str]] = []
+    for row_number, value in zip(row_numbers[bad_amount], raw_amounts[bad_amount]):
+        error_rows.append((row_number, f"Row {row_number}: Invalid data - amount '{value}'"))
+    for row_number, value in zip(row_numbers[bad_category], raw_categories[bad_category]):
+        error_rows.append((row_number, f"Row {row_number}: Invalid data - category '{value}'"))
+    for row_number, value in zip(row_numbers[bad_date], raw_dates[bad_date]):
+        error_rows.append((row_number, f"Row {row_number}: Invalid date format '{value}'"))
+    error_rows.sort()
+
+    accepted = ~(bad_amount | bad_category | bad_date)
+    if 'description' in df.columns:
+        descriptions = df['description'].fillna('').astype(str)
+    else:
+        descriptions = pd.Series('', index=df.index)
+
+    clean = pd.DataFrame({
+        'amount': amounts[accepted].astype(float),
+        'category': categories[accepted].astype(int),
+        'date': dates[accepted].dt.date,
+        'description': descriptions[accepted],
+    })
+    return clean, [message for _, message in error_rows]
+
+
+def read_csv_chunks(binary_stream: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    # Decode the upload incrementally so only one chunk is ever resident
+    import pandas as pd
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8', newline='')
+    return iter(pd.read_csv(text_stream, chunksize=chunk_size))
+
+
+def iter_batches(clean: pd.DataFrame, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[Dict]]:
+    # Slices of plain dicts, ready for an executemany insert
+    for start in range(0, len(clean), batch_size):
+        yield clean.iloc[start:start + batch_size].to_dict('records')
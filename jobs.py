@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from models import db, Job, current_ledger_id, get_data_version, use_ledger
+
+# A job still 'running' after this many seconds is assumed lost with its worker and requeued
+JOB_TIMEOUT_SECONDS: float = 600.0
+
+# Finished jobs kept per (ledger, kind) for the /jobs status endpoint
+JOB_HISTORY_PER_KIND: int = 50
+
+
+class JobResult(NamedTuple):
+    result: object
+    data_version: int
+    finished_at: float
+
+
+class JobQueue:
+    """A small SQLite-backed work queue drained by local worker threads.
+
+    Handlers are registered per job kind and run inside an app context with
+    the ledger the job was queued for made active. Jobs and results are kept
+    per ledger. ``enqueue`` coalesces: a kind that is already waiting for a
+    ledger is not queued twice, so a burst of writes triggers at most one
+    more run. The queue lives in
+    the application database, so every web worker process can pick jobs up
+    and read the latest results without an external broker. Like the
+    SQLAlchemy extension it can be created first and bound to an app from a
+    factory with ``init_app``.
+    """
+
+    def __init__(self, app=None, workers: int = 1, poll_interval: float = 1.0):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._handlers: Dict[str, Callable[[], object]] = {}
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.workers = app.config.get('JOB_WORKERS', self.workers)
+        app.extensions['job_queue'] = self
+
+    def register(self, kind: str, handler: Callable[[], object]) -> None:
+        self._handlers[kind] = handler
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, kind: str) -> None:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        ledger_id = current_ledger_id()
+        if not Job.query.filter_by(ledger_id=ledger_id, kind=kind, status='queued').first():
+            db.session.add(Job(ledger_id=ledger_id, kind=kind, status='queued', enqueued_at=time.time()))
+            db.session.commit()
+        self.start()
+        self._wakeup.set()
+
+    def latest_result(self, kind: str) -> Optional[JobResult]:
+        job = Job.query.filter_by(ledger_id=current_ledger_id(), kind=kind, status='done').order_by(Job.id.desc()).first()
+        if job is None:
+            return None
+        return JobResult(json.loads(job.result), job.data_version, job.finished_at)
+
+    def latest_version(self, kind: str) -> Optional[int]:
+        # Data version of the newest finished result, without loading the result itself
+        return Job.query.with_entities(Job.data_version).filter_by(
+            ledger_id=current_ledger_id(), kind=kind, status='done').order_by(Job.id.desc()).limit(1).scalar()
+
+    def status(self, limit: int = 20) -> List[Dict]:
+        jobs = Job.query.filter_by(ledger_id=current_ledger_id()).order_by(Job.id.desc()).limit(limit).all()
+        return [{
+            'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'data_version': job.data_version,
+            'enqueued_at': job.enqueued_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+            'wait_seconds': job.started_at - job.enqueued_at if job.started_at else None,
+            'run_seconds': job.finished_at - job.started_at if job.finished_at and job.started_at else None,
+            'error': job.error,
+        } for job in jobs]
+
+    def _work(self) -> None:
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    while (job_id := self._claim()) is not None:
+                        self._run(job_id)
+            except Exception as e:
+                print(f"Error in job worker: {e}")
+
+    def _claim(self) -> Optional[int]:
+        now = time.time()
+        Job.query.filter(Job.status == 'running', Job.started_at < now - JOB_TIMEOUT_SECONDS).update(
+            {'status': 'queued', 'started_at': None})
+        db.session.commit()
+        while True:
+            job = Job.query.filter_by(status='queued').order_by(Job.id).first()
+            if job is None:
+                return None
+            # Conditional update so only one worker (thread or process) wins the job
+            claimed = Job.query.filter_by(id=job.id, status='queued').update(
+                {'status': 'running', 'started_at': now})
+            db.session.commit()
+            if claimed:
+                return job.id
+
+    def _run(self, job_id: int) -> None:
+        job = db.session.get(Job, job_id)
+        with use_ledger(job.ledger_id):
+            job.data_version = get_data_version()
+            db.session.commit()
+            try:
+                result = self._handlers[job.kind]()
+                job.result = json.dumps(result)
+                job.status = 'done'
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                job.status = 'failed'
+                job.error = str(e)
+            job.finished_at = time.time()
+            db.session.commit()
+            self._prune(job.kind)
+
+    def _prune(self, kind: str) -> None:
+        finished = Job.query.filter(Job.ledger_id == current_ledger_id(), Job.kind == kind,
+                                    Job.status.in_(['done', 'failed']))
+        keep = finished.with_entities(Job.id).order_by(Job.id.desc()).offset(JOB_HISTORY_PER_KIND).limit(1).scalar()
+        if keep is not None:
+            finished.filter(Job.id <= keep).delete()
+            db.session.commit()
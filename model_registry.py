@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import copy
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+from flask import current_app
+from sqlalchemy import func
+
+from dates import normalize_dates
+from models import db, Transaction, current_ledger_id, get_data_version, use_ledger
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Fewer rows than this and no model is fitted (FinanceAdvisor needs 10 for insights anyway)
+MIN_TRAINING_ROWS: int = 10
+
+MODEL_NAMES = ('kmeans',)
+
+
+def data_fingerprint() -> Dict[str, int]:
+    row_count, last_id = db.session.query(
+        func.count(Transaction.id), func.coalesce(func.max(Transaction.id), 0)).filter(
+        Transaction.ledger_id == current_ledger_id()).one()
+    return {'data_version': get_data_version(), 'row_count': row_count, 'last_id': last_id}
+
+
+def _training_frame(after_id: int = 0) -> pd.DataFrame:
+    import pandas as pd
+    rows = db.session.query(Transaction.amount, Transaction.category, Transaction.date).filter(
+        Transaction.ledger_id == current_ledger_id(), Transaction.id > after_id).order_by(Transaction.id).all()
+    frame = pd.DataFrame(rows, columns=['amount', 'category', 'date'])
+    frame['date'] = normalize_dates(frame['date'])
+    return frame
+
+
+class ModelRegistry:
+    """Fitted FinanceAdvisor models persisted on disk and tagged with the data they saw.
+
+    Each model is stored as ``<model_dir>/<name>.joblib`` together with the
+    data fingerprint (data_version, row_count, last_id) it was trained on.
+    Models are reused until the data version moves on. When transactions
+    were only appended the KMeans model is updated with ``partial_fit`` on
+    the new rows; otherwise it is refitted. With ``background=True`` refits
+    run on a worker thread and requests keep serving the previous models in
+    the meantime. Spend forecast models (see forecasting.ForecastEngine) are
+    stored here too, under their own name and fingerprints. A registry
+    serves one ledger (the one active when it is called) and should get a
+    model_dir of its own.
+
+    joblib and scikit-learn are imported on the first load, save or fit, not
+    when the registry is created.
+    """
+
+    def __init__(self, model_dir: str, background: bool = True):
+        self.model_dir = model_dir
+        self.background = background
+        self._loaded: Dict[str, Tuple[float, object, Dict]] = {}
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.model_dir, f"{name}.joblib")
+
+    def load(self, name: str) -> Optional[Tuple[object, Dict]]:
+        # Cached in memory, re-read only when another worker has replaced the file
+        path = self._path(name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        cached = self._loaded.get(name)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        import joblib
+        try:
+            model, meta = joblib.load(path)
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable model file {path} - {e}")
+            return None
+        self._loaded[name] = (mtime, model, meta)
+        return model, meta
+
+    def save(self, name: str, model, meta: Dict) -> None:
+        import joblib
+        os.makedirs(self.model_dir, exist_ok=True)
+        path = self._path(name)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        joblib.dump((model, meta), temp_path)
+        os.replace(temp_path, path)
+
+    def current_models(self, app) -> Dict[str, object]:
+        """Return the latest fitted models, scheduling a refresh if the data changed."""
+        data_version = get_data_version()
+        models: Dict[str, object] = {}
+        stale = False
+        for name in MODEL_NAMES:
+            entry = self.load(name)
+            if entry is None or entry[1]['data_version'] != data_version:
+                stale = True
+            if entry is not None:
+                models[name] = entry[0]
+
+        if stale:
+            if self.background:
+                self.refresh_in_background(app)
+            else:
+                self.refresh()
+                models = {name: entry[0] for name in MODEL_NAMES if (entry := self.load(name))}
+        return models
+
+    def refresh_in_background(self, app) -> None:
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._refresh_with_context,
+                                            args=(app, current_ledger_id()), daemon=True)
+            self._worker.start()
+
+    def _refresh_with_context(self, app, ledger_id: int) -> None:
+        with app.app_context(), use_ledger(ledger_id):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing models: {e}")
+
+    def refresh(self) -> None:
+        fingerprint = data_fingerprint()
+        if fingerprint['row_count'] < MIN_TRAINING_ROWS:
+            return
+        started = time.perf_counter()
+        meta = dict(fingerprint, trained_at=time.time())
+
+        kmeans_entry = self.load('kmeans')
+        if kmeans_entry is None or kmeans_entry[1]['data_version'] != fingerprint['data_version']:
+            kmeans_model = None
+            if kmeans_entry is not None:
+                previous = kmeans_entry[1]
+                appended = _training_frame(after_id=previous['last_id'])
+                # Append-only since the last fit: every current row is either old or new
+                if previous['row_count'] + len(appended) == fingerprint['row_count']:
+                    kmeans_model = copy.deepcopy(kmeans_entry[0])
+                    if not appended.empty:
+                        kmeans_model.partial_fit(appended[['amount', 'category']])
+            if kmeans_model is None:
+                from finance_advisor import fit_kmeans_model
+                kmeans_model = fit_kmeans_model(_training_frame())
+            self.save('kmeans', kmeans_model, meta)
+
+        current_app.logger.info("Refreshed models at data version %d in %.2fs",
+                                fingerprint['data_version'], time.perf_counter() - started)
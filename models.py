@@ -0,0 +1,441 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from datetime import date
+from typing import Dict, Optional
+from flask import current_app
+from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import validates
+
+from dates import normalize_dates, parse_date
+
+# Ledger used when a request or job does not pick one; existing data is migrated into it
+DEFAULT_LEDGER_ID: int = 1
+DEFAULT_LEDGER_NAME: str = 'Personal'
+
+# Tables holding one ledger's data; with per-ledger databases they live in the ledger's own file
+LEDGER_TABLES = frozenset({'transactions', 'spending_aggregates', 'category_stats', 'app_state'})
+
+# Index names from before transactions and jobs carried a ledger_id
+LEGACY_INDEXES = ('ix_transactions_date', 'ix_transactions_category_date', 'ix_jobs_kind_status')
+
+# Columns added to transactions after it was first released; older databases get them via ALTER TABLE
+ADDED_TRANSACTION_COLUMNS: Dict[str, str] = {'fingerprint': 'BIGINT', 'anomaly_score': 'FLOAT'}
+
+# FTS5 index over transactions.description for /api/search. It is an external-content table,
+# so the text is not stored twice, and the triggers keep it in step with every insert, update
+# and delete, whichever code path makes them. prefix='2 3' indexes short prefixes as they are typed.
+SEARCH_TABLE = 'transactions_fts'
+SEARCH_INDEX_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(description, content='transactions', "
+    "content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON transactions BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, description) VALUES (new.id, new.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON transactions BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, description) VALUES ('delete', old.id, old.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF description ON transactions BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, description) VALUES ('delete', old.id, old.description); "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, description) VALUES (new.id, new.description); END",
+    # Indexes whatever the table already holds
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')",
+)
+
+_current_ledger: ContextVar[int] = ContextVar('current_ledger', default=DEFAULT_LEDGER_ID)
+
+# Set on every new SQLite connection. WAL lets readers keep reading while an upload
+# commits; synchronous=NORMAL is still crash-safe in WAL mode and saves an fsync per commit
+SQLITE_PRAGMAS: Dict[str, object] = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 30000,  # ms a writer waits for another writer before 'database is locked'
+    'cache_size': -65536,  # KiB of page cache per connection
+    'temp_store': 'MEMORY',
+    'mmap_size': 268435456,
+}
+
+_sqlite_pragmas: Dict[str, object] = dict(SQLITE_PRAGMAS)
+
+# Directory of per-ledger SQLite files, or None to keep every ledger in the main database
+_ledger_database_dir: Optional[str] = None
+_ledger_engine_options: Dict = {}
+_ledger_engines: Dict[int, Engine] = {}
+_ledger_engines_lock = threading.Lock()
+
+
+def current_ledger_id() -> int:
+    return _current_ledger.get()
+
+
+def activate_ledger(ledger_id: int) -> Token:
+    # Pair with deactivate_ledger; use_ledger does both around a block
+    return _current_ledger.set(ledger_id)
+
+
+def deactivate_ledger(token: Token) -> None:
+    _current_ledger.reset(token)
+
+
+@contextmanager
+def use_ledger(ledger_id: int):
+    token = activate_ledger(ledger_id)
+    try:
+        yield
+    finally:
+        deactivate_ledger(token)
+
+
+def configure_sqlite(**pragmas) -> None:
+    # Overrides for SQLITE_PRAGMAS, e.g. journal_mode='DELETE'; applies to connections opened afterwards
+    _sqlite_pragmas.clear()
+    _sqlite_pragmas.update(SQLITE_PRAGMAS, **pragmas)
+
+
+@event.listens_for(Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in _sqlite_pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def engine_options(database_uri: str, pool_size: int, max_overflow: int, pool_timeout: float) -> Dict:
+    """SQLAlchemy engine options giving every worker process a bounded connection pool.
+
+    File-backed SQLite gets a QueuePool with connections shared across threads;
+    in-memory SQLite keeps Flask-SQLAlchemy's single static connection.
+    """
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return {}
+        return {'poolclass': QueuePool, 'pool_size': pool_size, 'max_overflow': max_overflow,
+                'pool_timeout': pool_timeout, 'connect_args': {'check_same_thread': False}}
+    return {'pool_size': pool_size, 'max_overflow': max_overflow, 'pool_timeout': pool_timeout,
+            'pool_pre_ping': True}
+
+
+def configure_ledger_databases(directory: Optional[str], options: Optional[Dict] = None) -> None:
+    """Give every ledger other than the default its own SQLite file in ``directory``.
+
+    Separate files keep ledgers isolated and let writes to different ledgers
+    run in parallel, since SQLite locks a whole database file per write.
+    """
+    global _ledger_database_dir, _ledger_engine_options
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    dispose_ledger_engines()  # engines of a previous app may point at another directory or use other options
+    _ledger_database_dir = directory or None
+    _ledger_engine_options = dict(options or {})
+
+
+def dispose_ledger_engines() -> None:
+    """Close every per-ledger engine and its pooled connections; engines are recreated on next use."""
+    with _ledger_engines_lock:
+        for engine in _ledger_engines.values():
+            engine.dispose()
+        _ledger_engines.clear()
+
+
+def ledger_engine(ledger_id: int) -> Engine:
+    with _ledger_engines_lock:
+        engine = _ledger_engines.get(ledger_id)
+        if engine is None:
+            path = os.path.join(_ledger_database_dir, f"ledger-{ledger_id}.db")
+            engine = create_engine(f"sqlite:///{path}", **_ledger_engine_options)
+            db.metadata.create_all(engine, tables=[table for name, table in db.metadata.tables.items()
+                                                   if name in LEDGER_TABLES])
+            with engine.begin() as connection:
+                _add_transaction_columns(connection)
+                for index in Transaction.__table__.indexes:
+                    index.create(connection, checkfirst=True)
+                _ensure_search_index(connection)
+            _ledger_engines[ledger_id] = engine
+        return engine
+
+
+def _fts5_available() -> bool:
+    connection = sqlite3.connect(':memory:')
+    try:
+        connection.execute("CREATE VIRTUAL TABLE probe USING fts5(text)")
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        connection.close()
+
+
+# False when this SQLite build lacks FTS5; description search then falls back to LIKE
+FTS5_AVAILABLE: bool = _fts5_available()
+
+
+def search_index_enabled(connection_or_engine) -> bool:
+    return FTS5_AVAILABLE and connection_or_engine.dialect.name == 'sqlite'
+
+
+def _statement_table(mapper, clause):
+    if mapper is not None:
+        return inspect(mapper).local_table
+    table = getattr(clause, 'table', None)  # insert/update/delete
+    if table is None and hasattr(clause, 'get_final_froms'):
+        froms = clause.get_final_froms()
+        table = froms[0] if len(froms) == 1 else None
+    return table
+
+
+class LedgerSession(Session):
+    # Sends statements on ledger tables to the active ledger's database file, when configured
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _ledger_database_dir is not None and current_ledger_id() != DEFAULT_LEDGER_ID:
+            table = _statement_table(mapper, clause)
+            if getattr(table, 'name', None) in LEDGER_TABLES:
+                return ledger_engine(current_ledger_id())
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': LedgerSession})
+
+# Rows copied per statement when migrating the legacy string-dated table
+MIGRATION_CHUNK_SIZE: int = 50000
+
+
+def normalize_description(description) -> str:
+    # Exports of the same statement differ in case and spacing
+    return ' '.join(description.split()).casefold() if isinstance(description, str) else ''
+
+
+def transaction_fingerprint(day, amount, description) -> int:
+    """64-bit hash of (date, amount in paise, normalized description); signed, so SQLite stores it as an INTEGER."""
+    key = f"{parse_date(day)}|{round(float(amount) * 100)}|{normalize_description(description)}"
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def _default_fingerprint(context) -> int:
+    # Inserts that do not pass a fingerprint (e.g. Transaction(...) or a bulk insert of plain records)
+    parameters = context.get_current_parameters()
+    return transaction_fingerprint(parameters['date'], parameters['amount'], parameters.get('description'))
+
+
+class Ledger(db.Model):
+    # One household's books; every transaction, aggregate and job belongs to one ledger
+    __tablename__ = 'ledgers'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False, unique=True)
+
+
+class Transaction(db.Model):
+    __tablename__ = 'transactions'
+    __table_args__ = (
+        db.Index('ix_transactions_ledger_date', 'ledger_id', 'date'),
+        db.Index('ix_transactions_ledger_category_date', 'ledger_id', 'category', 'date'),
+        db.Index('ix_transactions_ledger_fingerprint', 'ledger_id', 'fingerprint'),
+        db.Index('ix_transactions_ledger_anomaly', 'ledger_id', 'anomaly_score'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    ledger_id = db.Column(db.Integer, nullable=False, default=current_ledger_id)
+    amount = db.Column(db.Float, nullable=False)
+    category = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    description = db.Column(db.String(100), default='')
+    # transaction_fingerprint(date, amount, description); duplicates are looked up by it (see detection.py)
+    fingerprint = db.Column(db.BigInteger, default=_default_fingerprint)
+    # Robust z-score against the category's rolling median/MAD when the row was added; NULL if not scored
+    anomaly_score = db.Column(db.Float)
+
+    @validates('date')
+    def validate_date(self, key, value):
+        # Accept date strings but always store a real date
+        parsed = parse_date(value) if isinstance(value, (str, date)) else None
+        if parsed is None:
+            raise ValueError(f"Invalid transaction date: {value!r}")
+        return parsed
+
+
+def _create_search_index(connection) -> None:
+    if search_index_enabled(connection):
+        for statement in SEARCH_INDEX_DDL:
+            connection.exec_driver_sql(statement)
+
+
+@event.listens_for(Transaction.__table__, 'after_create')
+def _transactions_created(target, connection, **kw) -> None:
+    # create_all, the string-date migration and new ledger files all create the index with the table
+    _create_search_index(connection)
+
+
+@event.listens_for(Transaction.__table__, 'before_drop')
+def _transactions_dropped(target, connection, **kw) -> None:
+    # An external-content index would otherwise point at rowids of a table that no longer exists
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class SpendingAggregate(db.Model):
+    # Running totals per (ledger, grain, bucket, category); grain is 'day', 'week', 'month' or 'category'
+    __tablename__ = 'spending_aggregates'
+    ledger_id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(8), primary_key=True)
+    bucket = db.Column(db.String(10), primary_key=True)
+    category = db.Column(db.Integer, primary_key=True)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CategoryStats(db.Model):
+    # Rolling window of each category's latest amounts, with its median and MAD, for anomaly scoring
+    __tablename__ = 'category_stats'
+    ledger_id = db.Column(db.Integer, primary_key=True)
+    category = db.Column(db.Integer, primary_key=True)
+    amounts = db.Column(db.Text, nullable=False, default='[]')  # JSON list, oldest first
+    median = db.Column(db.Float)  # NULL until the window is long enough to score against
+    mad = db.Column(db.Float)
+
+
+class AppState(db.Model):
+    # Small integer counters shared by every worker, e.g. 'data_version:<ledger_id>'
+    __tablename__ = 'app_state'
+    key = db.Column(db.String(32), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Job(db.Model):
+    # Background work queued after writes (see jobs.JobQueue); times are Unix timestamps
+    __tablename__ = 'jobs'
+    __table_args__ = (db.Index('ix_jobs_ledger_kind_status', 'ledger_id', 'kind', 'status'),)
+    id = db.Column(db.Integer, primary_key=True)
+    ledger_id = db.Column(db.Integer, nullable=False, default=DEFAULT_LEDGER_ID)
+    kind = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    data_version = db.Column(db.Integer)
+    enqueued_at = db.Column(db.Float, nullable=False)
+    started_at = db.Column(db.Float)
+    finished_at = db.Column(db.Float)
+    error = db.Column(db.Text)
+    result = db.Column(db.Text)
+
+
+def _data_version_key() -> str:
+    return f"data_version:{current_ledger_id()}"
+
+
+def get_data_version() -> int:
+    # Per ledger, so a write to one ledger leaves every other ledger's caches valid
+    state = db.session.get(AppState, _data_version_key())
+    return state.value if state else 0
+
+
+def bump_data_version() -> None:
+    # Called inside every write transaction so caches keyed on the version expire with it
+    db.session.execute(text(
+        "INSERT INTO app_state (key, value) VALUES (:key, 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + 1"),
+        {'key': _data_version_key()}, bind_arguments={'mapper': AppState})
+
+
+def _migrate_string_dates(connection) -> None:
+    # SQLite cannot alter a column type: keep the old table as transactions_legacy,
+    # recreate transactions with a DATE column and copy every parseable row across
+    connection.execute(text("ALTER TABLE transactions RENAME TO transactions_legacy"))
+    for index in inspect(connection).get_indexes('transactions_legacy'):
+        connection.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+    Transaction.__table__.create(connection)
+
+    import pandas as pd  # only needed for this one-off migration
+    copied = 0
+    skipped = 0
+    legacy_rows = pd.read_sql_query(
+        "SELECT id, amount, category, date, description FROM transactions_legacy",
+        connection, chunksize=MIGRATION_CHUNK_SIZE)
+    for chunk in legacy_rows:
+        chunk['date'] = normalize_dates(chunk['date'])
+        valid = chunk['date'].notna()
+        skipped += int((~valid).sum())
+        chunk = chunk[valid].copy()
+        chunk['date'] = chunk['date'].dt.date
+        chunk['description'] = chunk['description'].fillna('')
+        if not chunk.empty:
+            connection.execute(Transaction.__table__.insert(), chunk.to_dict('records'))
+            copied += len(chunk)
+
+    current_app.logger.info("Migrated %d transactions to a DATE column", copied)
+    if skipped:
+        print(f"Warning: {skipped} transactions with unparseable dates were left in transactions_legacy")
+
+
+def _column_names(inspector, table: str):
+    return {column['name'] for column in inspector.get_columns(table)}
+
+
+def _add_transaction_columns(connection) -> None:
+    inspector = inspect(connection)
+    if not inspector.has_table('transactions'):
+        return
+    existing = _column_names(inspector, 'transactions')
+    for name, column_type in ADDED_TRANSACTION_COLUMNS.items():
+        if name not in existing:
+            connection.execute(text(f"ALTER TABLE transactions ADD COLUMN {name} {column_type}"))
+
+
+def _ensure_search_index(connection) -> None:
+    # Databases from before search existed: index their descriptions once
+    inspector = inspect(connection)
+    if (search_index_enabled(connection) and inspector.has_table('transactions')
+            and not inspector.has_table(SEARCH_TABLE)):
+        _create_search_index(connection)
+        current_app.logger.info("Built the description search index")
+
+
+def _migrate_single_ledger(connection) -> None:
+    # Databases from before ledgers existed: every row joins the default ledger
+    inspector = inspect(connection)
+    if inspector.has_table('transactions') and 'ledger_id' not in _column_names(inspector, 'transactions'):
+        connection.execute(text(
+            f"ALTER TABLE transactions ADD COLUMN ledger_id INTEGER NOT NULL DEFAULT {DEFAULT_LEDGER_ID}"))
+    if inspector.has_table('jobs') and 'ledger_id' not in _column_names(inspector, 'jobs'):
+        connection.execute(text(
+            f"ALTER TABLE jobs ADD COLUMN ledger_id INTEGER NOT NULL DEFAULT {DEFAULT_LEDGER_ID}"))
+    # The primary key changed; ensure_aggregates refills the recreated table
+    if inspector.has_table('spending_aggregates') and 'ledger_id' not in _column_names(inspector, 'spending_aggregates'):
+        connection.execute(text("DROP TABLE spending_aggregates"))
+    if inspector.has_table('app_state'):
+        connection.execute(text("UPDATE app_state SET key = :key WHERE key = 'data_version'"),
+                           {'key': f"data_version:{DEFAULT_LEDGER_ID}"})
+    for name in LEGACY_INDEXES:
+        connection.execute(text(f'DROP INDEX IF EXISTS "{name}"'))
+
+
+def init_db() -> None:
+    """Create missing tables and upgrade databases from before DATE columns and ledgers."""
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        if inspector.has_table('transactions'):
+            date_column = next(c for c in inspector.get_columns('transactions') if c['name'] == 'date')
+            if 'CHAR' in str(date_column['type']).upper():
+                _migrate_string_dates(connection)
+        _migrate_single_ledger(connection)
+        _add_transaction_columns(connection)
+    # Also adds the ledger indexes to databases created before they existed
+    db.create_all()
+    with db.engine.begin() as connection:
+        for index in (*Transaction.__table__.indexes, *Job.__table__.indexes):
+            index.create(connection, checkfirst=True)
+        _ensure_search_index(connection)
+
+    if db.session.get(Ledger, DEFAULT_LEDGER_ID) is None:
+        db.session.add(Ledger(id=DEFAULT_LEDGER_ID, name=DEFAULT_LEDGER_NAME))
+        db.session.commit()
+
+    from aggregates import ensure_aggregates
+    from detection import ensure_detection
+    for ledger_id in [ledger.id for ledger in Ledger.query.order_by(Ledger.id)]:
+        with use_ledger(ledger_id):
+            ensure_aggregates()
+            ensure_detection()
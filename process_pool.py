@@ -0,0 +1,40 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Optional
+
+# Worker processes for chart rendering and Prophet fits, which share one pool
+DEFAULT_POOL_PROCESSES: int = min(4, os.cpu_count() or 1)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_processes: int = 0
+_pool_lock = threading.Lock()
+
+
+def get_process_pool(processes: int = DEFAULT_POOL_PROCESSES) -> Executor:
+    """The process pool shared by chart rendering and forecasting, with at least ``processes`` workers.
+
+    The pool is created on first use and replaced by a larger one when a
+    caller asks for more workers; work already submitted to the old pool
+    still completes.
+    """
+    global _pool, _pool_processes
+    with _pool_lock:
+        if _pool is None or processes > _pool_processes:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn: the pool is created from job threads, where forking is unsafe
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+            _pool_processes = processes
+        return _pool
+
+
+def shutdown_process_pool(wait: bool = True) -> None:
+    """Stop the pool's worker processes; the next get_process_pool() starts a new pool."""
+    global _pool, _pool_processes
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait)
+        _pool = None
+        _pool_processes = 0
@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets exported on /metrics
+LATENCY_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss() -> Optional[int]:
+    # Resident set size in bytes; Linux only, None elsewhere
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _SpanStats:
+    __slots__ = ('count', 'seconds', 'rows', 'memory_delta', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.memory_delta = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+
+class Profiler:
+    """Timing spans for the hot paths, aggregated per span name.
+
+    Spans are recorded into process-wide totals (exported by ``/metrics`` in
+    Prometheus text format) and, while a request is being collected, into a
+    per-request list used for the ``Server-Timing`` header. When disabled,
+    ``span`` hands back a shared no-op context manager, so instrumented code
+    pays one attribute check per span.
+    """
+
+    def __init__(self, enabled: bool = False, track_memory: bool = False):
+        self.enabled = enabled
+        self.track_memory = track_memory
+        self._stats: Dict[str, _SpanStats] = {}
+        self._lock = threading.Lock()
+        self._request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('request_spans', default=None)
+
+    def record(self, name: str, seconds: float, rows: Optional[int] = None, memory_delta: Optional[int] = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = _SpanStats()
+            stats.count += 1
+            stats.seconds += seconds
+            if rows is not None:
+                stats.rows += rows
+            if memory_delta is not None:
+                stats.memory_delta += memory_delta
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats.buckets[index] += 1
+                    break
+        request_spans = self._request_spans.get()
+        if request_spans is not None:
+            request_spans.append((name, seconds))
+
+    def span(self, name: str, rows: Optional[int] = None):
+        if not self.enabled:
+            return _NOOP_SPAN
+        return self._span(name, rows)
+
+    @contextmanager
+    def _span(self, name: str, rows: Optional[int]):
+        rss_before = current_rss() if self.track_memory else None
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            memory_delta = None
+            if rss_before is not None:
+                rss_after = current_rss()
+                memory_delta = rss_after - rss_before if rss_after is not None else None
+            self.record(name, elapsed, rows, memory_delta)
+
+    def start_request(self):
+        return self._request_spans.set([])
+
+    def finish_request(self, token) -> List[Tuple[str, float]]:
+        spans = self._request_spans.get() or []
+        self._request_spans.reset(token)
+        return spans
+
+    def server_timing(self, spans: List[Tuple[str, float]]) -> str:
+        # Same-named spans (e.g. every SQL statement) are summed into one entry
+        totals: Dict[str, float] = {}
+        for name, seconds in spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return ', '.join(
+            f"{name.replace(':', '-').replace('/', '_') or 'root'};dur={seconds * 1000:.2f}"
+            for name, seconds in totals.items())
+
+    def prometheus_text(self) -> str:
+        lines = [
+            '# HELP expense_span_seconds Time spent in instrumented spans.',
+            '# TYPE expense_span_seconds histogram',
+        ]
+        with self._lock:
+            snapshot = {name: (stats.count, stats.seconds, stats.rows, stats.memory_delta, list(stats.buckets))
+                        for name, stats in self._stats.items()}
+        for name, (count, seconds, _, _, buckets) in sorted(snapshot.items()):
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f'expense_span_seconds_bucket{{span="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'expense_span_seconds_bucket{{span="{label}",le="+Inf"}} {count}')
+            lines.append(f'expense_span_seconds_sum{{span="{label}"}} {seconds:.6f}')
+            lines.append(f'expense_span_seconds_count{{span="{label}"}} {count}')
+        lines.append('# HELP expense_span_rows_total Rows processed by instrumented spans.')
+        lines.append('# TYPE expense_span_rows_total counter')
+        for name, (_, _, rows, _, _) in sorted(snapshot.items()):
+            if rows:
+                lines.append(f'expense_span_rows_total{{span="{name}"}} {rows}')
+        if self.track_memory:
+            lines.append('# HELP expense_span_rss_delta_bytes_total Net resident memory change across spans.')
+            lines.append('# TYPE expense_span_rss_delta_bytes_total counter')
+            for name, (_, _, _, memory_delta, _) in sorted(snapshot.items()):
+                lines.append(f'expense_span_rss_delta_bytes_total{{span="{name}"}} {memory_delta}')
+        rss = current_rss()
+        if rss is not None:
+            lines.append('# HELP expense_process_resident_memory_bytes Resident memory of this worker.')
+            lines.append('# TYPE expense_process_resident_memory_bytes gauge')
+            lines.append(f'expense_process_resident_memory_bytes {rss}')
+        return '\n'.join(lines) + '\n'
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+# Process-wide profiler; app.py enables it from PROFILING_ENABLED
+profiler = Profiler()
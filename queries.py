@@ -0,0 +1,146 @@
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+from sqlalchemy import column, func, select, table, tuple_
+
+from dates import ISO_DATE_FORMAT
+from models import (db, SEARCH_TABLE, SpendingAggregate, Transaction, current_ledger_id,
+                    search_index_enabled)
+
+# Newest first; the id breaks ties between transactions on the same day
+NEWEST_FIRST = (Transaction.date.desc(), Transaction.id.desc())
+
+# The FTS5 index over descriptions (see models.SEARCH_INDEX_DDL); not part of the ORM metadata
+search_table = table(SEARCH_TABLE, column('rowid'), column(SEARCH_TABLE))
+
+# Searches matching more descriptions than this page through the (ledger_id, date) index instead
+# of looking every match up by id: a common term fills a page after a short walk down the index
+SEARCH_LOOKUP_LIMIT: int = 5000
+
+
+def parse_iso_date(value):
+    return datetime.strptime(value, ISO_DATE_FORMAT).date()
+
+
+def parse_cursor(value):
+    # Cursors look like '2024-03-05_1234': the (date, id) of the last row already seen
+    cursor_date, cursor_id = value.split('_', 1)
+    return parse_iso_date(cursor_date), int(cursor_id)
+
+
+def encode_cursor(transaction) -> str:
+    return f"{transaction.date.isoformat()}_{transaction.id}"
+
+
+def search_terms(text: str) -> Optional[str]:
+    # Every word of the user's text must start a word of the description: 'sup mark' -> '"sup"* "mark"*'.
+    # Quoting each word keeps FTS5 operators and punctuation in the input from being interpreted.
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"*' for word in words) or None
+
+
+def _search_matches(terms: str):
+    return select(search_table.c.rowid).where(search_table.c[SEARCH_TABLE].op('MATCH')(terms))
+
+
+def search_match_count(terms: str) -> int:
+    # Reads only the FTS doclists (all ledgers sharing the database), so it is cheap even for common terms
+    return db.session.execute(select(func.count()).select_from(_search_matches(terms).subquery()),
+                              bind_arguments={'mapper': Transaction}).scalar()
+
+
+def _filter(query, args, category: bool = True, walk_index: bool = False):
+    """Apply the active ledger and the start/end, category and q filters of ``args`` to ``query``.
+
+    ``q`` is an FTS5 prefix search where the index exists, a LIKE scan
+    otherwise. SQLite would answer the search by walking the ledger's index
+    and probing the match list on every row, which costs the same for one
+    match as for all of them. So unless ``walk_index`` is set, the ledger
+    column is hidden from the planner (``ledger_id + 0``) and each match is
+    looked up by id instead, at a cost proportional to the matches.
+    """
+    start = args.get('start', type=parse_iso_date)
+    end = args.get('end', type=parse_iso_date)
+    categories = args.getlist('category', type=int) if category else []
+    description = args.get('q', '').strip()
+    terms = search_terms(description) if description and search_index_enabled(db.engine) else None
+
+    if terms is not None and not walk_index:
+        query = query.filter(Transaction.ledger_id + 0 == current_ledger_id())
+    else:
+        query = query.filter(Transaction.ledger_id == current_ledger_id())
+    if start:
+        query = query.filter(Transaction.date >= start)
+    if end:
+        query = query.filter(Transaction.date <= end)
+    if categories:
+        query = query.filter(Transaction.category.in_(categories))
+    if terms is not None:
+        query = query.filter(Transaction.id.in_(_search_matches(terms)))
+    elif description:
+        query = query.filter(Transaction.description.contains(description, autoescape=True))
+    return query
+
+
+def filtered_transactions(args, walk_index: bool = False):
+    # The active ledger, plus optional date range, categories (repeatable) and description search,
+    # all evaluated by SQLite
+    return _filter(Transaction.query, args, walk_index=walk_index)
+
+
+def category_counts(args) -> Dict[int, int]:
+    """Matching transactions per category: the facet counts for a search.
+
+    The date range and description search apply, the category filter does not,
+    so the counts show what picking another category would return. Without a
+    description they are summed from the per-day rollups in spending_aggregates,
+    which costs one row per day and category rather than one per transaction.
+    """
+    if args.get('q', '').strip():
+        query = _filter(db.session.query(Transaction.category, func.count(Transaction.id)), args, category=False)
+        return dict(query.group_by(Transaction.category).all())
+
+    start = args.get('start', type=parse_iso_date)
+    end = args.get('end', type=parse_iso_date)
+    query = db.session.query(SpendingAggregate.category, func.sum(SpendingAggregate.count)).filter(
+        SpendingAggregate.ledger_id == current_ledger_id(),
+        SpendingAggregate.grain == ('day' if start or end else 'category'))
+    if start:
+        query = query.filter(SpendingAggregate.bucket >= start.isoformat())
+    if end:
+        query = query.filter(SpendingAggregate.bucket <= end.isoformat())
+    return {category: count for category, count in query.group_by(SpendingAggregate.category) if count}
+
+
+def filter_args(args) -> Dict[str, Union[str, Tuple[str, ...]]]:
+    # The filter parameters that have to be carried over to the next page link; categories
+    # are a tuple since the parameter can repeat
+    filters: Dict[str, Union[str, Tuple[str, ...]]] = {key: args[key] for key in ('start', 'end', 'q') if args.get(key)}
+    categories = tuple(value for value in args.getlist('category') if value)
+    if categories:
+        filters['category'] = categories
+    return filters
+
+
+def transaction_page(args, default_page_size: int, max_page_size: int) -> Tuple[List, Optional[str], int]:
+    """Return one keyset page of filtered transactions, newest first.
+
+    Each page seeks past the ``after`` cursor on the (ledger_id, date) index instead of
+    using OFFSET, so fetching a deep page costs the same as the first one. A search
+    walks that index too when it has more than SEARCH_LOOKUP_LIMIT matches; rarer
+    terms are looked up by id and sorted.
+    """
+    page_size = args.get('page_size', default_page_size, type=int)
+    page_size = min(max(page_size, 1), max_page_size)
+
+    terms = search_terms(args.get('q', ''))
+    walk_index = (terms is not None and search_index_enabled(db.engine)
+                  and search_match_count(terms) > SEARCH_LOOKUP_LIMIT)
+    query = filtered_transactions(args, walk_index=walk_index)
+    after = args.get('after', type=parse_cursor)
+    if after:
+        query = query.filter(tuple_(Transaction.date, Transaction.id) < after)
+
+    rows = query.order_by(*NEWEST_FIRST).limit(page_size + 1).all()
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor, page_size
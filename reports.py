@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import base64
+import calendar
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from charts import CHARTS, chart_series, render_series
+from models import db, SpendingAggregate, current_ledger_id
+from profiling import profiler
+from queries import parse_iso_date
+
+# ?month= for a one-month report
+REPORT_MONTH_FORMAT = '%Y-%m'
+
+
+def parse_month(value: str) -> date:
+    return datetime.strptime(value, REPORT_MONTH_FORMAT).date()
+
+
+def month_period(month: date) -> Tuple[date, date]:
+    return month.replace(day=1), month.replace(day=calendar.monthrange(month.year, month.month)[1])
+
+
+def report_period(args) -> Tuple[Optional[date], Optional[date]]:
+    # ?month=2024-05 for one calendar month, otherwise ?start= and ?end=; either end may be left open
+    month = args.get('month', type=parse_month)
+    if month:
+        return month_period(month)
+    return args.get('start', type=parse_iso_date), args.get('end', type=parse_iso_date)
+
+
+def daily_rollups(start: Optional[date], end: Optional[date]) -> List:
+    """(bucket, category, total, count) per day and category of the active ledger, oldest first.
+
+    The report is built from these rather than from the transactions: one row
+    per day and category, however many transactions the ledger holds.
+    """
+    query = db.session.query(SpendingAggregate.bucket, SpendingAggregate.category,
+                             SpendingAggregate.total, SpendingAggregate.count
+                             ).filter(SpendingAggregate.ledger_id == current_ledger_id(),
+                                      SpendingAggregate.grain == 'day',
+                                      SpendingAggregate.count > 0)
+    if start:
+        query = query.filter(SpendingAggregate.bucket >= start.isoformat())
+    if end:
+        query = query.filter(SpendingAggregate.bucket <= end.isoformat())
+    return query.order_by(SpendingAggregate.bucket, SpendingAggregate.category).all()
+
+
+def monthly_summary(days: List) -> List[Dict]:
+    # One entry per month: spend per category, total spend and number of transactions
+    months: Dict[str, Dict] = {}
+    for bucket, category, total, count in days:
+        month = months.setdefault(bucket[:7], {'month': bucket[:7], 'categories': {}, 'total': 0.0, 'count': 0})
+        month['categories'][category] = month['categories'].get(category, 0.0) + total
+        month['total'] += total
+        month['count'] += count
+    return list(months.values())
+
+
+def report_charts(days: List) -> Iterator[Tuple[str, str]]:
+    """(title, base64 PNG) for every chart of the /graphs page.
+
+    Every chart sums amounts, so the daily totals draw the same pictures as
+    the transactions themselves. A generator, so a streamed report can send
+    the tables before the charts are rendered.
+    """
+    if not days:
+        return
+    import pandas as pd
+    frame = pd.DataFrame({
+        'amount': [total for _, _, total, _ in days],
+        'category': [category for _, category, _, _ in days],
+        'date': pd.to_datetime([bucket for bucket, _, _, _ in days]),
+    })
+    for name, series in chart_series(frame).items():
+        with profiler.span(f'chart:{name}'):
+            yield CHARTS[name], base64.b64encode(render_series(name, series, 'png')).decode('ascii')
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import json
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+from sqlalchemy import func
+
+from dates import normalize_dates
+from models import db, Transaction, current_ledger_id, get_data_version
+from profiling import profiler
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+# One little-endian file per column; dates are days since 1970-01-01, descriptions are
+# indexes into descriptions.json
+COLUMN_DTYPES: Dict[str, str] = {
+    'id': '<i8',
+    'amount': '<f8',
+    'category': 'i1',
+    'date': '<i4',
+    'description': '<i4',
+}
+
+# Stored for categories outside the int8 range (the UI only uses 1-8)
+UNKNOWN_CATEGORY: int = -1
+
+# Compact once deleted rows make up this share of the snapshot
+COMPACT_RATIO: float = 0.2
+
+# Rows read per pass when rebuilding from the transactions table
+SNAPSHOT_CHUNK_SIZE: int = 100000
+
+FORMAT_VERSION = 1
+
+
+def encode_categories(values) -> np.ndarray:
+    # Category ids as the int8 column stored here and in TransactionBatch; ids outside the range become UNKNOWN_CATEGORY
+    import numpy as np
+    category = np.asarray(values, dtype=np.int64)
+    return np.where((category >= -128) & (category <= 127), category, UNKNOWN_CATEGORY).astype(np.int8)
+
+
+class Snapshot:
+    """Memory-mapped column arrays of every live transaction, in id order."""
+    __slots__ = ('ids', 'amount', 'category', 'days', 'description_codes', 'descriptions', 'data_version')
+
+    def __init__(self, ids, amount, category, days, description_codes, descriptions, data_version):
+        self.ids = ids
+        self.amount = amount
+        self.category = category
+        self.days = days
+        self.description_codes = description_codes
+        self.descriptions = descriptions
+        self.data_version = data_version
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def dates(self) -> np.ndarray:
+        return self.days.astype('datetime64[D]')
+
+    def frame(self, description: bool = True) -> pd.DataFrame:
+        """amount/category/date(/description) columns; amount and category share the mapped memory."""
+        import pandas as pd
+        columns = {
+            'amount': self.amount,
+            'category': self.category,
+            'date': self.dates().astype('datetime64[ns]'),
+        }
+        if description:
+            columns['description'] = pd.Categorical.from_codes(self.description_codes, categories=self.descriptions)
+        return pd.DataFrame(columns, copy=False)
+
+
+class SnapshotStore:
+    """A columnar copy of one ledger's transactions for analytics reads.
+
+    The write paths append new rows to the column files (``record_inserts``)
+    and record deleted ids as tombstones. The files are compacted once
+    tombstones pass ``COMPACT_RATIO``. A write the snapshot could not follow
+    (another process wrote in between, or an id was reused) leaves it behind
+    the data version; ``load`` then catches up first: it appends rows with
+    ids above the last one seen, and rebuilds from SQLite when the live row
+    count no longer matches.
+    manifest.json is replaced last and atomically, so a crash mid-append
+    leaves the previous snapshot intact. A lock file serialises worker
+    processes. Each ledger gets its own directory; the store reads the
+    ledger active when it is called. Recording deletes and clearing only
+    touch the files, so /delete does not import numpy or pandas.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path('.lock'), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_json(self, name: str):
+        try:
+            with open(self._path(name)) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, name: str, value) -> None:
+        temp_path = self._path(f"{name}.{os.getpid()}.tmp")
+        with open(temp_path, 'w') as handle:
+            json.dump(value, handle)
+        os.replace(temp_path, self._path(name))
+
+    def _read_manifest(self) -> Optional[Dict]:
+        manifest = self._read_json('manifest.json')
+        if manifest is None or manifest.get('format') != FORMAT_VERSION:
+            return None
+        return manifest
+
+    def _map(self, name: str, rows: int) -> np.ndarray:
+        import numpy as np
+        if rows == 0:
+            return np.empty(0, dtype=COLUMN_DTYPES.get(name, '<i8'))
+        return np.memmap(self._path(f"{name}.bin"), dtype=COLUMN_DTYPES.get(name, '<i8'), mode='r', shape=(rows,))
+
+    @staticmethod
+    def _encode(frame: pd.DataFrame, descriptions: List[str], codes: Dict[str, int]) -> Dict[str, np.ndarray]:
+        # frame: id, amount, category, date, description; new descriptions extend the dictionary
+        import numpy as np
+        import pandas as pd
+        distinct_codes, distinct = pd.factorize(frame['description'].fillna('').astype(str))
+        lookup = np.empty(len(distinct), dtype='<i4')
+        for index, text in enumerate(distinct):
+            if text not in codes:
+                codes[text] = len(descriptions)
+                descriptions.append(text)
+            lookup[index] = codes[text]
+
+        days = normalize_dates(frame['date']).to_numpy().astype('datetime64[D]').astype('<i4')
+        return {
+            'id': frame['id'].to_numpy(dtype='<i8'),
+            'amount': frame['amount'].to_numpy(dtype='<f8'),
+            'category': encode_categories(frame['category']),
+            'date': days,
+            'description': lookup[distinct_codes],
+        }
+
+    def _write_rows(self, manifest: Dict, frames: Iterable[pd.DataFrame], suffix: str = '') -> Dict:
+        # Appends to the column files; files past manifest['rows'] (a crashed append) are cut back first
+        import numpy as np
+        descriptions = self._read_json(f"descriptions.json{suffix}") or []
+        codes = {text: index for index, text in enumerate(descriptions)}
+        handles = {}
+        try:
+            for name, dtype in COLUMN_DTYPES.items():
+                handle = open(self._path(f"{name}.bin{suffix}"), 'ab')
+                handle.truncate(manifest['rows'] * np.dtype(dtype).itemsize)
+                handles[name] = handle
+            for frame in frames:
+                if frame.empty:
+                    continue
+                for name, values in self._encode(frame, descriptions, codes).items():
+                    handles[name].write(values.tobytes())
+                manifest['rows'] += len(frame)
+                manifest['last_id'] = max(manifest['last_id'], int(frame['id'].max()))
+        finally:
+            for handle in handles.values():
+                handle.close()
+        self._write_json(f"descriptions.json{suffix}", descriptions)
+        return manifest
+
+    def _sql_frames(self, after_id: int = 0) -> Iterable[pd.DataFrame]:
+        import pandas as pd
+        columns = ['id', 'amount', 'category', 'date', 'description']
+        rows = db.session.query(Transaction.id, Transaction.amount, Transaction.category,
+                                Transaction.date, Transaction.description
+                                ).filter(Transaction.ledger_id == current_ledger_id(),
+                                         Transaction.id > after_id).order_by(Transaction.id)
+        chunk = []
+        for row in rows.yield_per(SNAPSHOT_CHUNK_SIZE):
+            chunk.append(row)
+            if len(chunk) >= SNAPSHOT_CHUNK_SIZE:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+        yield pd.DataFrame(chunk, columns=columns)
+
+    def _replace_files(self, frames: Iterable[pd.DataFrame], data_version: int) -> Dict:
+        # Rebuild and compaction write a fresh set of files, then swap them in; readers
+        # holding the old maps keep the old inodes
+        suffix = f".{os.getpid()}.new"
+        if os.path.exists(self._path(f"descriptions.json{suffix}")):
+            os.remove(self._path(f"descriptions.json{suffix}"))  # left over from an interrupted rebuild
+        manifest = {'format': FORMAT_VERSION, 'rows': 0, 'last_id': 0, 'tombstones': 0, 'data_version': data_version}
+        manifest = self._write_rows(manifest, frames, suffix)
+        for name in COLUMN_DTYPES:
+            os.replace(self._path(f"{name}.bin{suffix}"), self._path(f"{name}.bin"))
+        os.replace(self._path(f"descriptions.json{suffix}"), self._path('descriptions.json'))
+        open(self._path('tombstones.bin'), 'wb').close()
+        self._write_json('manifest.json', manifest)
+        return manifest
+
+    def _rebuild(self, data_version: int) -> Dict:
+        with profiler.span('snapshot:rebuild'):
+            return self._replace_files(self._sql_frames(), data_version)
+
+    def _compact(self, manifest: Dict) -> Dict:
+        import numpy as np
+        import pandas as pd
+        with profiler.span('snapshot:compact', rows=manifest['rows']):
+            snapshot = self._open(manifest)
+            frame = pd.DataFrame({
+                'id': snapshot.ids,
+                'amount': snapshot.amount,
+                'category': snapshot.category,
+                'date': snapshot.dates(),
+                'description': np.asarray(snapshot.descriptions, dtype=object)[snapshot.description_codes]
+                if len(snapshot) else np.empty(0, dtype=object),
+            })
+            return self._replace_files([frame], manifest['data_version'])
+
+    def _sync(self, manifest: Optional[Dict]) -> Dict:
+        data_version = get_data_version()
+        if manifest is not None and manifest['data_version'] == data_version:
+            return manifest
+        if manifest is None:
+            return self._rebuild(data_version)
+
+        with profiler.span('snapshot:append'):
+            manifest = self._write_rows(manifest, self._sql_frames(after_id=manifest['last_id']))
+        live_rows = manifest['rows'] - manifest['tombstones']
+        if live_rows != db.session.query(func.count(Transaction.id)).filter(
+                Transaction.ledger_id == current_ledger_id()).scalar():
+            # A change the tombstones and appends did not capture (e.g. a reused id)
+            return self._rebuild(data_version)
+        manifest['data_version'] = data_version
+        if manifest['tombstones'] > COMPACT_RATIO * manifest['rows']:
+            return self._compact(manifest)
+        self._write_json('manifest.json', manifest)
+        return manifest
+
+    def _open(self, manifest: Dict) -> Snapshot:
+        import numpy as np
+        rows = manifest['rows']
+        columns = {name: self._map(name, rows) for name in COLUMN_DTYPES}
+        descriptions = self._read_json('descriptions.json') or []
+        if manifest['tombstones']:
+            deleted = self._map('tombstones', manifest['tombstones'])
+            live = ~np.isin(columns['id'], deleted)
+            columns = {name: values[live] for name, values in columns.items()}
+        return Snapshot(columns['id'], columns['amount'], columns['category'], columns['date'],
+                        columns['description'], descriptions, manifest['data_version'])
+
+    def load(self) -> Snapshot:
+        """The snapshot at the current data version, synced from SQLite first if needed."""
+        with self._locked():
+            manifest = self._sync(self._read_manifest())
+            with profiler.span('snapshot:open', rows=manifest['rows']):
+                return self._open(manifest)
+
+    def record_inserts(self, after_id: int, previous_version: int, data_version: int) -> None:
+        """Append the rows with ids above ``after_id``, committed by the writes that took the ledger
+        from ``previous_version`` to ``data_version``.
+
+        Only applied when the snapshot was at ``previous_version`` and no
+        snapshot row has an id above ``after_id``; otherwise the next ``load``
+        catches up.
+        """
+        with self._locked():
+            manifest = self._read_manifest()
+            if manifest is None or manifest['data_version'] != previous_version or after_id < manifest['last_id']:
+                return
+            with profiler.span('snapshot:append'):
+                manifest = self._write_rows(manifest, self._sql_frames(after_id=after_id))
+            manifest['data_version'] = data_version
+            self._write_json('manifest.json', manifest)
+
+    def record_deletes(self, ids: List[int]) -> None:
+        # Tombstones only; the row count check in _sync catches anything missed here
+        with self._locked():
+            manifest = self._read_manifest()
+            if manifest is None:
+                return
+            with open(self._path('tombstones.bin'), 'ab') as handle:
+                handle.truncate(manifest['tombstones'] * 8)
+                handle.write(struct.pack(f'<{len(ids)}q', *ids))
+            manifest['tombstones'] += len(ids)
+            self._write_json('manifest.json', manifest)
+
+    def clear(self) -> None:
+        with self._locked():
+            for name in os.listdir(self.directory):
+                if name != '.lock':
+                    os.remove(self._path(name))
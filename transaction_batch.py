@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+from datetime import date
+from pandas.api.types import union_categoricals
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+from dates import normalize_dates
+from ingest import DEFAULT_CHUNK_SIZE, read_csv_chunks, validate_frame
+from snapshot import encode_categories
+
+# Rows fetched per cursor round trip by from_query; bounds the row tuples alive at once
+QUERY_CHUNK_SIZE: int = 10000
+
+
+class TransactionRow:
+    """A read-only view of one row of a TransactionBatch, with the same attributes as a Transaction."""
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch: 'TransactionBatch', index: int):
+        self._batch = batch
+        self._index = index
+
+    @property
+    def amount(self) -> float:
+        return float(self._batch.amount[self._index])
+
+    @property
+    def category(self) -> int:
+        return int(self._batch.category[self._index])
+
+    @property
+    def date(self) -> Optional[date]:
+        value = self._batch.date[self._index]
+        return None if np.isnat(value) else pd.Timestamp(value).date()
+
+    @property
+    def description(self) -> str:
+        return self._batch.description[self._index]
+
+    def __repr__(self) -> str:
+        return f"TransactionRow(amount={self.amount}, category={self.category}, date={self.date}, description={self.description!r})"
+
+
+class TransactionBatch:
+    """Transactions stored as one typed array per column (struct of arrays).
+
+    amount is float64, category int8 and date datetime64[ns] (NaT where
+    unparseable). description is a pandas Categorical, so repeated merchant
+    names are stored once. Indexing or iterating yields TransactionRow
+    views, which are created on demand. FinanceAdvisor reads the arrays
+    directly.
+    """
+    __slots__ = ('amount', 'category', 'date', 'description')
+
+    def __init__(self, amount: np.ndarray, category: np.ndarray, date: np.ndarray, description: pd.Categorical):
+        if not len(amount) == len(category) == len(date) == len(description):
+            raise ValueError("TransactionBatch columns must have the same length")
+        self.amount = amount
+        self.category = category
+        self.date = date
+        self.description = description
+
+    def __len__(self) -> int:
+        return len(self.amount)
+
+    def __getitem__(self, index: int) -> TransactionRow:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return TransactionRow(self, index)
+
+    def __iter__(self) -> Iterator[TransactionRow]:
+        return (TransactionRow(self, index) for index in range(len(self)))
+
+    @property
+    def nbytes(self) -> int:
+        return self.amount.nbytes + self.category.nbytes + self.date.nbytes + self.description.nbytes
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame) -> 'TransactionBatch':
+        """From a DataFrame with amount, category, date and (optionally) description columns."""
+        if 'description' not in frame.columns:
+            description = pd.Categorical([''] * len(frame))
+        elif isinstance(frame['description'].dtype, pd.CategoricalDtype):
+            description = frame['description'].array  # e.g. Snapshot.frame(): already dictionary-encoded
+        else:
+            description = pd.Categorical(frame['description'].fillna('').astype(str))
+        return cls(frame['amount'].to_numpy(dtype=np.float64),
+                   encode_categories(frame['category']),
+                   normalize_dates(frame['date']).to_numpy(),
+                   description)
+
+    @classmethod
+    def from_records(cls, records: Iterable) -> 'TransactionBatch':
+        """From dicts or objects with amount/category/date/description; invalid rows are skipped."""
+        amounts: List[float] = []
+        categories: List[int] = []
+        dates: List = []
+        descriptions: List[str] = []
+        for record in records:
+            try:
+                if isinstance(record, dict):
+                    amount, category = float(record['amount']), int(record['category'])
+                    transaction_date, description = record['date'], record.get('description')
+                else:
+                    amount, category = float(record.amount), int(record.category)
+                    transaction_date, description = record.date, record.description
+            except (ValueError, TypeError, AttributeError, KeyError) as e:
+                print(f"Warning: Skipping invalid transaction data - {e}")
+                continue
+            amounts.append(amount)
+            categories.append(category)
+            dates.append(transaction_date)
+            descriptions.append(str(description) if description else '')
+        return cls(np.array(amounts, dtype=np.float64),
+                   encode_categories(categories),
+                   normalize_dates(dates).to_numpy(),
+                   pd.Categorical(descriptions))
+
+    @classmethod
+    def from_query(cls, query, chunk_size: int = QUERY_CHUNK_SIZE) -> 'TransactionBatch':
+        """Run a Transaction query (filters and ordering kept) into column arrays, without ORM objects.
+
+        Only the four columns are selected, and rows are streamed ``chunk_size``
+        at a time, so at most one chunk of row tuples is alive at once.
+        """
+        entity = query.column_descriptions[0]['entity']
+        statement = query.with_entities(entity.amount, entity.category, entity.date, entity.description).statement
+        result = query.session.execute(statement, execution_options={'yield_per': chunk_size})
+        parts: List[TransactionBatch] = []
+        for rows in result.partitions():
+            amounts, categories, dates, descriptions = zip(*rows)
+            parts.append(cls(np.array(amounts, dtype=np.float64),
+                             encode_categories(categories),
+                             normalize_dates(dates).to_numpy(),
+                             pd.Categorical([description or '' for description in descriptions])))
+        return cls.concat(parts)
+
+    @classmethod
+    def from_csv(cls, stream: BinaryIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Tuple['TransactionBatch', List[str]]:
+        """Read and validate an upload-format CSV; returns the accepted rows and the per-row errors."""
+        frames: List[pd.DataFrame] = []
+        errors: List[str] = []
+        rows_seen = 0
+        for chunk in read_csv_chunks(stream, chunk_size):
+            clean, chunk_errors = validate_frame(chunk, row_offset=rows_seen)
+            frames.append(clean)
+            errors.extend(chunk_errors)
+            rows_seen += len(chunk)
+        return cls.concat([cls.from_frame(frame) for frame in frames]), errors
+
+    @classmethod
+    def concat(cls, batches: List['TransactionBatch']) -> 'TransactionBatch':
+        if not batches:
+            return cls.from_records([])
+        if len(batches) == 1:
+            return batches[0]
+        return cls(np.concatenate([batch.amount for batch in batches]),
+                   np.concatenate([batch.category for batch in batches]),
+                   np.concatenate([batch.date for batch in batches]),
+                   union_categoricals([batch.description for batch in batches]))
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'amount': self.amount,
+            'category': self.category,
+            'date': self.date,
+            'description': self.description,
+        }, copy=False)